@@ -3,10 +3,18 @@ The ``plugin`` module implements a sophisticated, featureful plugin loader
 based on Exocet, with interface-based discovery.
 """
 
+import os
+import sys
+import threading
+import time
 from types import ModuleType
 from xml.sax import saxutils
 
-from exocet import ExclusiveMapper, getModule, load, pep302Mapper
+import exocet
+from exocet import (ExclusiveMapper, MapperStatistics, ModuleCache,
+                    addImportHook, flattenMapper, getModule, load,
+                    openBundle, pep302Mapper, specLoad, BundleMapper,
+                    modificationTime)
 
 from twisted.internet import reactor
 from twisted.python import log
@@ -27,6 +35,30 @@ class PluginException(Exception):
     Signal an error encountered during plugin handling.
     """
 
+class LoadBudgetExceeded(BaseException):
+    """
+    A plugin module took too long to load, and was aborted.
+
+    This isn't an ``Exception``, so that plugins can't swallow it with
+    ``except Exception``.
+
+    :ivar str module: the name of the module
+    :ivar str resource: ``"wall"`` or ``"cpu"``, the kind of time that ran out
+    :ivar float limit: the number of seconds the module was allowed
+    :ivar float used: the number of seconds it had used when it was aborted
+    """
+
+    def __init__(self, module, resource, limit, used):
+        BaseException.__init__(self, module, resource, limit, used)
+        self.module = module
+        self.resource = resource
+        self.limit = limit
+        self.used = used
+
+    def __str__(self):
+        return ("Plugin module %s used %.3fs of %s time, over its budget of "
+            "%.3fs" % (self.module, self.used, self.resource, self.limit))
+
 
 class IBravoPlugin(Interface):
     """
@@ -71,7 +103,10 @@ class ISortedPlugin(IBravoPlugin):
         """)
 
 
-blacklisted = set([
+# The modules plugins may not import, and the modules they're given instead of
+# the real ones for some names. bravoMapper is compiled from these when it's
+# built, so changing them takes a call to rebuild_mapper().
+blacklisted = frozenset([
     "asyncore",        # Use Twisted's event loop.
     "ctypes",          # Segfault protection.
     "gc",              # Haha, no.
@@ -87,8 +122,35 @@ overrides = {
     "twisted.internet.reactor": reactor,
     "saxutils": saxutils,
 }
-bravoMapper = ExclusiveMapper(pep302Mapper,
-                              blacklisted).withOverrides(overrides)
+bravoMapper = flattenMapper(
+    ExclusiveMapper(pep302Mapper, blacklisted,
+                    subtrees=True).withOverrides(overrides))
+
+def rebuild_mapper():
+    """
+    Rebuild ``bravoMapper`` from ``blacklisted`` and ``overrides``.
+
+    The mapper is compiled from them when it's built, so changes to either
+    only take effect once this is called. ``blacklisted`` is a frozenset; to
+    blacklist more modules, replace it:
+
+    >>> bravo_plugin.blacklisted |= frozenset(["pickle"])
+    >>> bravo_plugin.rebuild_mapper()
+
+    Plugins already discovered and modules already loaded are forgotten, so
+    that no plugin keeps what the new rules refuse.
+    """
+
+    global bravoMapper, plugin_mapper, module_cache
+    bravoMapper = flattenMapper(
+        ExclusiveMapper(pep302Mapper, blacklisted,
+                        subtrees=True).withOverrides(overrides))
+    module_cache = ModuleCache()
+    if plugin_path is not None:
+        plugin_mapper = BundleMapper(plugin_path, bravoMapper,
+                                     cache=module_cache)
+    with __cache_lock:
+        __cache.clear()
 
 def sort_plugins(plugins):
     """
@@ -221,6 +283,306 @@ def synthesize_parameters(parameters):
 
 __cache = {}
 
+# Discoveries in progress for the plugin cache, keyed by interface, and the
+# lock guarding both.
+__discoveries = {}
+__cache_lock = threading.Lock()
+
+# Loading plugins swaps out the interpreter's import state, so only one thread
+# discovers plugins at a time, whatever the interface. It's reentrant since
+# plugins may ask for other plugins while they're loaded; the thread-local
+# depth tells when they do.
+__discovery_lock = threading.RLock()
+__discovering = threading.local()
+
+class _Discovery(object):
+    """
+    A discovery of the plugins for an interface, which other threads
+    wanting the same plugins can wait for.
+
+    :ivar owner: the thread doing the discovery
+    :ivar done: an Event set once the discovery has finished
+    """
+
+    def __init__(self):
+        self.owner = threading.current_thread()
+        self.done = threading.Event()
+
+# Plugin modules loaded without parameters. Each module is only executed once
+# for all of the interfaces it provides plugins for, until its file changes.
+module_cache = ModuleCache()
+
+# Import statistics for plugin discovery, if enabled.
+statistics = None
+
+def enable_statistics():
+    """
+    Start recording which imports plugin discovery spends its time on.
+
+    Lookups are counted and timed for each layer of the plugin mapper, and
+    attributed to the plugin module that made them. Call ``report()`` on the
+    returned object after discovery for a summary.
+
+    :returns: the ``exocet.MapperStatistics`` being recorded into
+    """
+
+    global statistics
+    if statistics is None:
+        statistics = MapperStatistics()
+        addImportHook(statistics)
+    return statistics
+
+# The function plugin modules are loaded with.
+loader = load
+
+def use_spec_loader(enabled=True):
+    """
+    Choose whether plugin modules are loaded with ``exocet.specLoad``.
+
+    That loader isolates each plugin module with builtins of its own instead
+    of swapping out the interpreter's import state for every load, which is
+    cheaper and doesn't disturb other threads. On Python 2, though, code with
+    its own builtins runs in restricted mode, where plugins can't open files.
+
+    Modules already loaded are forgotten, so that every plugin module is
+    loaded the same way.
+
+    :param bool enabled: whether to use ``exocet.specLoad`` instead of
+        ``exocet.load``
+    """
+
+    global loader, module_cache, plugin_mapper
+    loader = specLoad if enabled else load
+    module_cache = ModuleCache()
+    if plugin_path is not None:
+        plugin_mapper = BundleMapper(plugin_path, bravoMapper,
+                                     cache=module_cache)
+
+# The exocet PythonPath plugin packages are found in, if not sys.path, and the
+# mapper that lets plugins loaded from it import each other.
+plugin_path = None
+plugin_mapper = None
+
+def use_plugin_bundle(path=None):
+    """
+    Discover plugins in a bundle instead of on ``sys.path``.
+
+    A bundle is written ahead of time with ``exocet.writeBundle``, or
+    ``python -m exocet._bundle bravo.plugins plugins.bundle``, and holds the
+    compiled code and import analysis of every plugin module, so that
+    discovery needs a single read of one file instead of a walk of the plugin
+    tree. Plugins' imports of modules in the bundle are resolved from the
+    bundle, and other imports through the plugin mapper.
+
+    Plugins already discovered and modules already loaded are forgotten.
+
+    :param str path: the path of the bundle, or None to go back to
+        discovering plugins on ``sys.path``
+    """
+
+    global plugin_path, plugin_mapper, module_cache
+    module_cache = ModuleCache()
+    if path is None:
+        plugin_path = plugin_mapper = None
+    else:
+        plugin_path = openBundle(path)
+        # Modules imported by other plugins and plugin modules found by
+        # discovery come from the same cache, so each is executed once.
+        plugin_mapper = BundleMapper(plugin_path, bravoMapper,
+                                     cache=module_cache)
+    with __cache_lock:
+        __cache.clear()
+
+# The number of threads plugin packages are listed with during discovery, or
+# None to list them one at a time.
+discovery_threads = None
+
+# Per-module (wall, cpu) time limits for plugin loading, if any.
+load_budget = None
+
+# LoadBudgetExceeded errors for the plugin modules that were aborted. Modules
+# which hang in a blocking call are never aborted, so never show up here.
+budget_reports = []
+
+# How often, in seconds, the load budget's watchdog checks the time used.
+budget_interval = 0.01
+
+def set_load_budget(wall=None, cpu=None):
+    """
+    Limit the time each plugin module may spend being loaded.
+
+    Modules that run over are aborted and skipped, and a
+    ``LoadBudgetExceeded`` describing them is added to ``budget_reports``.
+
+    A watchdog checks the limits every ``budget_interval`` seconds, and a
+    module which is over is aborted at its next line of Python, outside of
+    Exocet and this module, so that the import state Exocet swaps out is
+    always put back.
+
+    Budgets can't interrupt blocking calls. A module whose top-level code
+    hangs in ``time.sleep()``, a socket read, or any other call into C that
+    doesn't return, hangs discovery with it; it's only aborted, and
+    reported, if the call returns.
+
+    :param float wall: seconds of wall-clock time allowed, or None
+    :param float cpu: seconds of CPU time allowed, or None
+    """
+
+    global load_budget
+    if wall is None and cpu is None:
+        load_budget = None
+    else:
+        load_budget = wall, cpu
+
+def _cpu_time():
+    """
+    Get the CPU time used by this process so far.
+    """
+
+    user, system = os.times()[:2]
+    return user + system
+
+# Code in these files is never interrupted by a load budget.
+_uninterruptible = (os.path.dirname(os.path.abspath(exocet.__file__)) + os.sep,
+    os.path.splitext(os.path.abspath(__file__))[0] + ".py")
+
+# Whether code from each file may be interrupted, by file name.
+_interruptible_files = {}
+
+def _interruptible(frame):
+    """
+    Determine whether a frame runs code a load budget may interrupt.
+    """
+
+    filename = frame.f_code.co_filename
+    try:
+        return _interruptible_files[filename]
+    except KeyError:
+        path = os.path.abspath(filename)
+        interruptible = not (path.startswith(_uninterruptible[0])
+            or path == _uninterruptible[1])
+        _interruptible_files[filename] = interruptible
+        return interruptible
+
+def _in_finalizer(frame):
+    """
+    Determine whether a frame runs on behalf of a finalizer.
+
+    Python ignores errors raised by finalizers, and a trace function whose
+    error is ignored is never called again.
+    """
+
+    while frame is not None:
+        if frame.f_code.co_name == "__del__":
+            return True
+        frame = frame.f_back
+    return False
+
+def _call_with_budget(name, wall, cpu, f, *args, **kwargs):
+    """
+    Call a function, aborting it if it runs out of time.
+
+    A watchdog thread checks the clocks, so the function runs at full speed
+    until it's over budget; only then are its frames traced line by line, so
+    that it can be interrupted. The budget is only enforced in code outside
+    of Exocet and this module, and never in finalizers. If the function
+    catches the ``LoadBudgetExceeded`` it's interrupted with and carries on,
+    it's raised again once the function returns.
+
+    :param str name: the module name to report
+    :param float wall: seconds of wall-clock time allowed, or None
+    :param float cpu: seconds of CPU time allowed, or None
+
+    :raises LoadBudgetExceeded: the function ran out of time
+    """
+
+    wall_start = time.time()
+    cpu_start = _cpu_time()
+    # The error to interrupt the function with, once it's over budget, and
+    # whether the function is still running.
+    expired = []
+    running = [True]
+    caller = sys._getframe()
+    ident = threading.current_thread().ident
+
+    def exceeded():
+        if wall is not None and time.time() - wall_start > wall:
+            return LoadBudgetExceeded(name, "wall", wall,
+                time.time() - wall_start)
+        if cpu is not None and _cpu_time() - cpu_start > cpu:
+            return LoadBudgetExceeded(name, "cpu", cpu,
+                _cpu_time() - cpu_start)
+        return None
+
+    def check(frame, event, arg):
+        if not running or not expired:
+            return None
+        if event == "line" and not _in_finalizer(frame):
+            raise expired[0]
+        return check
+
+    def trace_calls(frame, event, arg):
+        if expired and running and _interruptible(frame):
+            return check
+        return None
+
+    def watch():
+        while True:
+            time.sleep(budget_interval)
+            if not running:
+                return
+            e = exceeded()
+            if e is not None:
+                expired.append(e)
+                # Trace the frames already running, which weren't traced
+                # when they were called, unless the function has returned.
+                frames = []
+                frame = sys._current_frames().get(ident)
+                while frame is not None and frame is not caller:
+                    if _interruptible(frame):
+                        frames.append(frame)
+                    frame = frame.f_back
+                if frame is caller:
+                    for frame in frames:
+                        frame.f_trace = check
+                return
+
+    watchdog = threading.Thread(target=watch, name="load budget: " + name)
+    watchdog.daemon = True
+    tracer = sys.gettrace()
+    sys.settrace(trace_calls)
+    watchdog.start()
+    try:
+        result = f(*args, **kwargs)
+    finally:
+        del running[:]
+        sys.settrace(tracer)
+    e = exceeded()
+    if e is not None:
+        raise e
+    return result
+
+# Plugin modules which failed to load, so that they aren't tried again until
+# they change. Maps (path, parameter names) to (mtime, name, error, file).
+broken_modules = {}
+
+def list_broken_plugins():
+    """
+    List the plugin modules which failed to load and haven't changed since.
+
+    Modules which failed with several sets of parameters are listed once,
+    with one of their errors.
+
+    :returns: a sorted list of (module name, path, error) tuples
+    """
+
+    broken = {}
+    for (path, names), (mtime, name, error, fp) in broken_modules.items():
+        if mtime is None or modificationTime(fp) != mtime:
+            continue
+        broken[path] = name, path, error
+    return sorted(broken.values())
+
 def get_plugins(interface, package, parameters=None):
     """
     Lazily find objects in a package which implement a given interface.
@@ -244,51 +606,84 @@ def get_plugins(interface, package, parameters=None):
     :param dict parameters: parameters to pass into the plugins
     """
 
-    mapper = bravoMapper
+    mapper = bravoMapper if plugin_mapper is None else plugin_mapper
+    cache = module_cache
+
+    if statistics is not None:
+        mapper = statistics.instrument(mapper)
 
     # If parameters are provided, add them to the mapper in a synthetic
-    # module.
+    # module. The modules loaded with them are specific to this call, so
+    # they aren't cached.
     if parameters:
         mapper = mapper.withOverrides(
             {"bravo.parameters": synthesize_parameters(parameters)})
+        cache = None
+
+    # Whether a module fails to load can depend on which parameters it's
+    # given, so failures are remembered per set of parameter names.
+    parameter_names = tuple(sorted(parameters)) if parameters else ()
 
-    # This stack will let us iteratively recurse into packages during the
-    # module search.
-    stack = [getModule(package)]
-
-    # While there are packages left to search...
-    while stack:
-        # For each package/module in the package...
-        for pm in stack.pop().iterModules():
-            # If it's a package, append it to the list of packages to search.
-            if pm.isPackage():
-                stack.append(pm)
-
-            try:
-                # Load the module.
-                m = load(pm, mapper)
-
-                # Make a good attempt to iterate through the module's
-                # contents, and see what matches our interface.
-                for obj in vars(m).itervalues():
-                    try:
-                        adapted = interface(obj, None)
-                    except:
-                        log.err()
-                    else:
-                        if adapted is not None:
-                            yield adapted
-            except ImportError, ie:
-                log.msg(ie)
-            except SyntaxError, se:
-                log.msg(se)
+    if plugin_path is None:
+        root = getModule(package)
+    else:
+        root = plugin_path[package]
+
+    # Walk every module below the package. The order doesn't matter here, so
+    # when packages are listed in threads, modules are taken as they come.
+    modules = root.walkModules(threads=discovery_threads, ordered=False)
+    # The walk starts with the package itself, which isn't a plugin module.
+    next(modules)
+
+    for pm in modules:
+        # Skip modules which are known to be broken, unless they've
+        # changed since. Modules whose modification time can't be
+        # determined are retried every time.
+        key = pm.filePath.path, parameter_names
+        mtime = modificationTime(pm.filePath)
+        if key in broken_modules:
+            if mtime is not None and broken_modules[key][0] == mtime:
+                continue
+            del broken_modules[key]
+
+        try:
+            # Load the module, refusing it before any of its code runs
+            # if it imports something unavailable.
+            if load_budget is None:
+                m = loader(pm, mapper, resolveImports=True, cache=cache)
+            else:
+                wall, cpu = load_budget
+                m = _call_with_budget(pm.name, wall, cpu, loader, pm,
+                    mapper, resolveImports=True, cache=cache)
+
+            # Make a good attempt to iterate through the module's
+            # contents, and see what matches our interface.
+            for obj in vars(m).itervalues():
+                try:
+                    adapted = interface(obj, None)
+                except:
+                    log.err()
+                else:
+                    if adapted is not None:
+                        yield adapted
+        except ImportError, ie:
+            broken_modules[key] = mtime, pm.name, ie, pm.filePath
+            log.msg(ie)
+        except SyntaxError, se:
+            broken_modules[key] = mtime, pm.name, se, pm.filePath
+            log.msg(se)
+        except LoadBudgetExceeded, lbe:
+            budget_reports.append(lbe)
+            log.msg(lbe)
 
 def retrieve_plugins(interface, parameters=None):
     """
     Look up all plugins for a certain interface.
 
     If the plugin cache is enabled, this function will not attempt to reload
-    plugins from disk or discover new plugins.
+    plugins from disk or discover new plugins. Concurrent calls for the same
+    interface share a single discovery, and discoveries for different
+    interfaces take turns.
 
     :param interface interface: the interface to use
     :param dict parameters: parameters to pass into the plugins
@@ -297,26 +692,63 @@ def retrieve_plugins(interface, parameters=None):
     :raises PluginException: no plugins could be found for the given interface
     """
 
-    if not parameters and interface in __cache:
-        return __cache[interface]
+    if parameters:
+        return _discover_plugins(interface, parameters)
+
+    # Only one thread discovers the plugins for an interface at a time; any
+    # others asking for them meanwhile wait for its result. If it fails, the
+    # next one in line tries again.
+    while True:
+        with __cache_lock:
+            if interface in __cache:
+                return __cache[interface]
+            discovery = __discoveries.get(interface)
+            if discovery is None:
+                discovery = __discoveries[interface] = _Discovery()
+                break
+        if (discovery.owner is threading.current_thread()
+            or getattr(__discovering, "depth", 0)):
+            # A plugin is asking for plugins of an interface being
+            # discovered, by this thread or by one waiting for this thread
+            # to finish discovering; waiting would deadlock.
+            return _discover_plugins(interface, parameters)
+        discovery.done.wait()
+
+    try:
+        d = _discover_plugins(interface, parameters)
+        with __cache_lock:
+            __cache[interface] = d
+    finally:
+        with __cache_lock:
+            del __discoveries[interface]
+        discovery.done.set()
+
+    return d
+
+def _discover_plugins(interface, parameters):
+    """
+    Find and verify all plugins for a certain interface, bypassing the plugin
+    cache.
+    """
 
     log.msg("Discovering %s..." % interface)
     d = {}
-    for p in get_plugins(interface, "bravo.plugins", parameters):
+    with __discovery_lock:
+        __discovering.depth = getattr(__discovering, "depth", 0) + 1
         try:
-            verify_plugin(interface, p)
-            d[p.name] = p
-        except PluginException:
-            pass
+            for p in get_plugins(interface, "bravo.plugins", parameters):
+                try:
+                    verify_plugin(interface, p)
+                    d[p.name] = p
+                except PluginException:
+                    pass
+        finally:
+            __discovering.depth -= 1
 
     if issubclass(interface, ISortedPlugin):
         # Sortable plugins need their edges mirrored.
         d = add_plugin_edges(d)
 
-    # Cache non-parameterized plugins.
-    if not parameters:
-        __cache[interface] = d
-
     return d
 
 def retrieve_named_plugins(interface, names, parameters=None):
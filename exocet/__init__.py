@@ -1,9 +1,23 @@
 # Copyright (c) 2010-2011 Allen Short. See LICENSE file for details.
-from exocet._exocet import (load, loadNamed, proxyModule, emptyMapper,
-                            pep302Mapper, IMapper, DictMapper,
-                            ExclusiveMapper, CallableMapper, getModule)
+from exocet._exocet import (load, loadNamed, loadPackage, proxyModule,
+                            cachedProxyModule, refreshProxy,
+                            emptyMapper, pep302Mapper, IMapper, DictMapper,
+                            ExclusiveMapper, CallableMapper, flattenMapper,
+                            ModuleCache, ImportEvent, addImportHook,
+                            removeImportHook, getModule, modificationTime)
+from exocet._statistics import MapperStatistics
+from exocet._specs import specLoad, specLoadNamed
+from exocet._modules import setAnalysisCacheDirectory
+from exocet._bundle import (writeBundle, openBundle, BundleImporter,
+                            BundleMapper)
 
-__all__= ['load', 'loadNamed', 'getModule', 'proxyModule', 'emptyMapper',
-          'pep302Mapper', 'IMapper', 'DictMapper', 'CallableMapper']
+__all__= ['load', 'loadNamed', 'loadPackage', 'getModule', 'proxyModule',
+          'cachedProxyModule', 'refreshProxy',
+          'emptyMapper', 'pep302Mapper', 'IMapper', 'DictMapper',
+          'CallableMapper', 'flattenMapper', 'ModuleCache', 'ImportEvent',
+          'addImportHook', 'removeImportHook', 'MapperStatistics',
+          'specLoad', 'specLoadNamed', 'writeBundle', 'openBundle',
+          'BundleImporter', 'BundleMapper', 'setAnalysisCacheDirectory',
+          'modificationTime']
 
 __version__ = '0.5'
@@ -0,0 +1,519 @@
+# -*- test-case-name: exocet.test.test_exocet -*-
+# Copyright (c) 2010-2011 Allen Short. See LICENSE file for details.
+
+"""
+Bundles: a package tree in a single file, holding each module's code object,
+compiled ahead of time, and the static analysis of its source, so that the
+whole tree can be searched and loaded from after one sequential read.
+
+Use L{writeBundle} to make one, and L{openBundle} to search it, e.g. for
+L{exocet.load}.  Putting L{BundleImporter} on C{sys.path_hooks} makes bundles
+on C{sys.path} importable as usual, too.
+
+A bundle is the magic string C{BUNDLE_MAGIC}, the magic number of the
+Python which wrote it, and then a marshalled C{(directories, members)}
+tuple.  C{directories} maps the path of every directory in the bundle,
+C{/}-separated, to a list of the names in it; C{members} maps the path of
+every module, named like its C{.pyc} file, to a tuple of its marshalled
+code object, the summary of its analysis, and the message of the error
+analyzing it.  Modules which can't be analyzed, such as those using
+C{import *}, have no summary, and are only refused if their analysis is
+used.
+"""
+
+import os
+import sys
+import imp
+import marshal
+import errno
+
+from zope.interface import implements
+
+from exocet._filepath import FilePath, _PathHelper
+from exocet._exocet import IMapper, load, _buildAndStoreEmptyModule
+from exocet._modules import (IPathImportMapper, PythonPath, getModule,
+                             _ImportExportFinder)
+from exocet._components import registerAdapter
+
+BUNDLE_MAGIC = "EXOCETB\x01"
+BUNDLE_SEP = "/"
+
+# The bundles read so far, keyed by path, with the bundle file's modification
+# time and size when it was read.
+_bundles = {}
+
+
+
+class BundlePath(_PathHelper):
+    """
+    I represent a module or directory in a bundle, in the manner of
+    L{exocet._zippath.ZipPath}.
+    """
+    def __init__(self, archive, pathInBundle):
+        """
+        Don't construct me directly.  Use BundleArchive.child().
+
+        @param archive: a L{BundleArchive}.
+
+        @param pathInBundle: a BUNDLE_SEP-separated string.
+        """
+        self.archive = archive
+        self.pathInBundle = pathInBundle
+        self.path = os.path.join(archive.bundlePath,
+                                 *pathInBundle.split(BUNDLE_SEP))
+
+
+    def __cmp__(self, other):
+        if not isinstance(other, BundlePath):
+            return NotImplemented
+        return cmp(self.path, other.path)
+
+
+    def __repr__(self):
+        return 'BundlePath(%r)' % (os.path.abspath(self.path),)
+
+
+    def parent(self):
+        splitup = self.pathInBundle.split(BUNDLE_SEP)
+        if len(splitup) == 1:
+            return self.archive
+        return BundlePath(self.archive, BUNDLE_SEP.join(splitup[:-1]))
+
+
+    def child(self, path):
+        if self.pathInBundle:
+            path = BUNDLE_SEP.join([self.pathInBundle, path])
+        return BundlePath(self.archive, path)
+
+
+    def sibling(self, path):
+        return self.parent().child(path)
+
+
+    def exists(self):
+        return self.isdir() or self.isfile()
+
+
+    def isdir(self):
+        return self.pathInBundle in self.archive.directories
+
+
+    def isfile(self):
+        return self.pathInBundle in self.archive.members
+
+
+    def islink(self):
+        return False
+
+
+    def listdir(self):
+        try:
+            return list(self.archive.directories[self.pathInBundle])
+        except KeyError:
+            if self.isfile():
+                raise OSError(errno.ENOTDIR, "Leaf bundle entry listed")
+            raise OSError(errno.ENOENT, "Non-existent bundle entry listed")
+
+
+    def splitext(self):
+        return os.path.splitext(self.path)
+
+
+    def basename(self):
+        return self.pathInBundle.split(BUNDLE_SEP)[-1]
+
+
+    def dirname(self):
+        return self.parent().path
+
+
+    def getContent(self):
+        """
+        Get the module's code as the contents of a C{.pyc} file.
+        """
+        try:
+            code = self.archive.members[self.pathInBundle][0]
+        except KeyError:
+            raise IOError(errno.ENOENT, "Non-existent bundle entry read")
+        return imp.get_magic() + "\0\0\0\0" + code
+
+
+    def getAnalysis(self):
+        """
+        Get the static analysis of the module's source, made when the bundle
+        was written.
+
+        @raise SyntaxError: if the source couldn't be analyzed.
+
+        @return: an L{_ImportExportFinder} which has already visited the
+        module's source.
+        """
+        code, summary, error = self.archive.members[self.pathInBundle]
+        if summary is None:
+            raise SyntaxError(error)
+        return _ImportExportFinder.fromSummary(summary)
+
+
+    def restat(self):
+        pass
+
+
+    def getModificationTime(self):
+        """
+        Modules in a bundle were all modified when the bundle was.
+        """
+        return self.archive.getModificationTime()
+
+
+
+class BundleArchive(BundlePath):
+    """
+    I am a FilePath-like object which wraps a bundle as if it were a
+    directory.
+
+    @ivar bundlePath: the path of the bundle file.
+
+    @ivar directories: a dict mapping the path of every directory in the
+    bundle to a list of the names in it.
+
+    @ivar members: a dict mapping the path of every module in the bundle to a
+    tuple of its marshalled code, the summary of its static analysis, and the
+    message of the error analyzing it.
+    """
+    archive = property(lambda self: self)
+
+    def __init__(self, bundlePath):
+        """
+        Read a bundle.
+
+        @param bundlePath: a str, naming a bundle file in the filesystem.
+
+        @raise ValueError: if the file isn't a bundle written by this version
+        of Python.
+        """
+        content = FilePath(bundlePath).getContent()
+        if content[:len(BUNDLE_MAGIC)] != BUNDLE_MAGIC:
+            raise ValueError("%s is not a bundle" % (bundlePath,))
+        content = content[len(BUNDLE_MAGIC):]
+        if content[:4] != imp.get_magic():
+            raise ValueError("%s was written by another version of Python"
+                             % (bundlePath,))
+        self.directories, self.members = marshal.loads(content[4:])
+        self.bundlePath = self.path = bundlePath
+        self.pathInBundle = ''
+
+
+    def parent(self):
+        return FilePath(self.bundlePath).parent()
+
+
+    def exists(self):
+        return FilePath(self.bundlePath).exists()
+
+
+    def getModificationTime(self):
+        return FilePath(self.bundlePath).getModificationTime()
+
+
+    def __repr__(self):
+        return 'BundleArchive(%r)' % (os.path.abspath(self.path),)
+
+
+
+def _segmentsFrom(path, bundlePath):
+    """
+    Return the segments of a path inside a bundle; none for the bundle
+    itself.
+    """
+    if FilePath(path) == FilePath(bundlePath):
+        return []
+    return FilePath(path).segmentsFrom(FilePath(bundlePath))
+
+
+
+def _getBundle(bundlePath):
+    """
+    Get a L{BundleArchive} for a bundle file, reusing the one read last time
+    unless the file has been modified since.
+    """
+    st = os.stat(bundlePath)
+    stamp = st.st_mtime, st.st_size
+    cached = _bundles.get(bundlePath)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    archive = BundleArchive(bundlePath)
+    _bundles[bundlePath] = stamp, archive
+    return archive
+
+
+
+class BundleImporter(object):
+    """
+    A PEP 302 path hook and importer for bundles, and paths inside them.
+
+    @ivar archive: the L{BundleArchive}.
+
+    @ivar prefix: the BUNDLE_SEP-separated path inside the bundle this
+    importer imports from.
+    """
+
+    def __init__(self, path):
+        """
+        @raise ImportError: if C{path} isn't a bundle or a path inside one.
+        """
+        bundlePath = path
+        while not os.path.isfile(bundlePath):
+            parent = os.path.dirname(bundlePath)
+            if parent == bundlePath:
+                raise ImportError("%s is not in a bundle" % (path,))
+            bundlePath = parent
+        try:
+            self.archive = _getBundle(bundlePath)
+        except (ValueError, EOFError, OSError, IOError), e:
+            raise ImportError(str(e))
+        self.path = path
+        self.prefix = BUNDLE_SEP.join(_segmentsFrom(path, bundlePath))
+
+
+    def _findMember(self, fullname):
+        """
+        Find the member of the bundle for a module.
+
+        @return: a tuple of the member's path, or C{None}, and whether it's a
+        package.
+        """
+        name = fullname.rpartition('.')[2]
+        if self.prefix:
+            name = BUNDLE_SEP.join([self.prefix, name])
+        for member, isPackage in [(name + BUNDLE_SEP + "__init__.pyc", True),
+                                  (name + ".pyc", False)]:
+            if member in self.archive.members:
+                return member, isPackage
+        return None, False
+
+
+    def find_module(self, fullname, path=None):
+        """
+        Module finder method required by PEP 302.
+        """
+        if self._findMember(fullname)[0] is not None:
+            return self
+        return None
+
+
+    def load_module(self, fullname):
+        """
+        Module loader method required by PEP 302.
+        """
+        member, isPackage = self._findMember(fullname)
+        if member is None:
+            raise ImportError(fullname)
+        memberPath = self.archive.child(member)
+        m = sys.modules.setdefault(fullname, imp.new_module(fullname))
+        # No __loader__: inspect would take that to mean the module's source
+        # can be found next to its __file__, and bundles have none.
+        m.__file__ = memberPath.path
+        if isPackage:
+            m.__path__ = [memberPath.parent().path]
+            m.__package__ = fullname
+        else:
+            m.__package__ = fullname.rpartition('.')[0]
+        try:
+            exec marshal.loads(memberPath.getContent()[8:]) in m.__dict__
+        except:
+            del sys.modules[fullname]
+            raise
+        return m
+
+
+
+class _BundleMapImpl:
+    """ IPathImportMapper implementation for L{BundleImporter}.  """
+    implements(IPathImportMapper)
+    def __init__(self, importer):
+        self.importer = importer
+
+    def mapPath(self, fsPathString):
+        """
+        Map the given FS path to a L{BundlePath}, by walking down into the
+        importer's bundle.
+        """
+        archive = self.importer.archive
+        bp = archive
+        for seg in _segmentsFrom(fsPathString, archive.bundlePath):
+            bp = bp.child(seg)
+        return bp
+
+registerAdapter(_BundleMapImpl, BundleImporter, IPathImportMapper)
+
+
+
+class BundleMapper(object):
+    """
+    A mapper that provides the modules in a bundle by loading them from it,
+    once each, with itself, and defers all other names to another mapper.
+    This lets modules loaded from a bundle import each other.
+
+    Given a L{ModuleCache}, modules from the bundle already loaded with this
+    mapper through the cache are provided from it, and those this mapper
+    loads are added to it, so that each is only executed once whether it's
+    loaded directly or imported by another module in the bundle.
+
+    @ivar _pythonPath: The L{PythonPath} searching the bundle, as returned by
+    L{openBundle}.
+    @ivar _submapper: The L{IMapper} provider used for all other names.
+    @ivar _overrides: A dict mapping names to the modules to provide for them
+    instead, from the bundle or C{submapper}.
+    @ivar _cache: A L{ModuleCache} shared with the callers loading modules
+    from the bundle with this mapper, or C{None}.
+    @ivar _namespace: A dict mapping the names of the modules loaded from the
+    bundle so far, or being loaded, to module objects.
+    """
+
+    implements(IMapper)
+
+    def __init__(self, pythonPath, submapper, overrides=None, cache=None):
+        self._pythonPath = pythonPath
+        self._submapper = submapper
+        if overrides is None:
+            overrides = {}
+        self._overrides = overrides
+        self._cache = cache
+        self._namespace = {}
+
+
+    def _maker(self, name):
+        """
+        Find a module in the bundle, or return None.
+        """
+        try:
+            return self._pythonPath[name]
+        except KeyError:
+            return None
+
+
+    def lookup(self, name):
+        """
+        @see L{IMapper.lookup}
+        """
+        if name in self._overrides:
+            return self._overrides[name]
+        if name in self._namespace:
+            return self._namespace[name]
+        maker = self._maker(name)
+        if maker is None:
+            return self._submapper.lookup(name)
+        if self._cache is not None:
+            m = self._cache.get(maker, self)
+            if m is not None:
+                return m
+        m = _buildAndStoreEmptyModule(maker, self._namespace)
+        try:
+            load(maker, self, m=m, cache=self._cache)
+        except:
+            del self._namespace[name]
+            raise
+        return m
+
+
+    def contains(self, name):
+        """
+        @see L{IMapper.contains}
+        """
+        if (name in self._overrides or name in self._namespace
+            or self._maker(name) is not None):
+            return True
+        return self._submapper.contains(name)
+
+
+    def withOverrides(self, overrides):
+        """
+        @see L{IMapper.withOverrides}
+
+        The modules in the bundle are loaded again, with the overrides, for
+        the returned mapper, which doesn't share this mapper's cache.
+        """
+        allOverrides = dict(self._overrides)
+        allOverrides.update(overrides)
+        return BundleMapper(self._pythonPath, self._submapper, allOverrides)
+
+
+
+def openBundle(bundlePath):
+    """
+    Search a bundle for modules, independent of C{sys.path}.
+
+    @param bundlePath: the path of a bundle file.
+
+    @return: a L{PythonPath} whose only entry is the bundle, which finds no
+    modules to have been loaded already.
+    """
+    return PythonPath(sysPath=[bundlePath], moduleDict={}, importerCache={},
+                      sysPathHooks=[BundleImporter])
+
+
+
+def writeBundle(package, bundlePath):
+    """
+    Write a bundle of a package, its subpackages and modules, and the
+    packages containing it.  Only modules with Python source are included.
+
+    @param package: a L{PythonModule} for a package, or its name.
+
+    @param bundlePath: the path of the bundle file to write.
+
+    @raise SyntaxError: if a module can't be compiled.
+    """
+    if isinstance(package, str):
+        package = getModule(package)
+    pythonPath = package.pathEntry.pythonPath
+    parts = package.name.split('.')
+    modules = [pythonPath['.'.join(parts[:i])] for i in range(1, len(parts))]
+    modules.extend(package.walkModules())
+
+    directories = {}
+    members = {}
+    for module in modules:
+        if module.filePath.splitext()[1] != '.py':
+            continue
+        segments = module.name.split('.')
+        if module.isPackage():
+            segments.append('__init__.pyc')
+        else:
+            segments[-1] += '.pyc'
+        for i in range(len(segments)):
+            children = directories.setdefault(BUNDLE_SEP.join(segments[:i]),
+                                              [])
+            if segments[i] not in children:
+                children.append(segments[i])
+        filename = os.path.join(bundlePath, *segments)[:-1]
+        code = compile(module.filePath.getContent(), filename, 'exec')
+        try:
+            module._maybeLoadFinder()
+        except SyntaxError, e:
+            summary, error = None, str(e)
+        else:
+            summary, error = module._finder.summary(), None
+        members[BUNDLE_SEP.join(segments)] = (marshal.dumps(code), summary,
+                                             error)
+
+    FilePath(bundlePath).setContent(
+        BUNDLE_MAGIC + imp.get_magic() + marshal.dumps((directories, members)))
+
+
+
+def main(argv=None):
+    """
+    Write a bundle from the command line: C{python -m exocet._bundle
+    package.name output.bundle}.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    if len(argv) != 2:
+        sys.stderr.write("usage: python -m exocet._bundle PACKAGE BUNDLE\n")
+        return 2
+    writeBundle(argv[0], argv[1])
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,20 +2,180 @@
 # Copyright (c) 2010-2011 Allen Short. See LICENSE file for details.
 
 
-import sys, __builtin__, itertools, traceback, functools
+import sys, __builtin__, itertools, traceback, functools, imp, marshal
+from collections import OrderedDict
 from exocet._modules import getModule
 from types import ModuleType
 from zope.interface import Interface, implements
 
-DEBUG = False
 _sysModulesSpecialCases = {
     "os": ['path'],
     "twisted.internet": ["reactor"],
 }
 
-def trace(*args):
-    if DEBUG:
-        print ' '.join(str(x) for x in args)
+
+# Kinds of ImportEvent.
+LOOKUP = "lookup"
+HIT = "hit"
+MISS = "miss"
+LOAD_START = "loadStart"
+LOAD_END = "loadEnd"
+
+class ImportEvent(object):
+    """
+    Something that happened while importing or loading modules in isolation,
+    as reported to the hooks registered with L{addImportHook}.
+
+    @ivar kind: One of C{LOOKUP} (an import is being resolved by a mapper),
+    C{HIT} (the mapper resolved it), C{MISS} (the mapper couldn't),
+    C{LOAD_START} (a module is about to be loaded: its imports resolved, if
+    asked for, and its code executed) or C{LOAD_END} (it has been loaded,
+    successfully or not).
+
+    @ivar name: The fully-qualified name of the module imported or loaded.
+
+    @ivar mapper: The L{IMapper} provider used.
+
+    @ivar module: The module resolved or loaded, or C{None} if there isn't
+    one (yet).
+    """
+
+    def __init__(self, kind, name, mapper, module=None):
+        self.kind = kind
+        self.name = name
+        self.mapper = mapper
+        self.module = module
+
+
+    def __repr__(self):
+        return "<ImportEvent %s %s in %r: %r>" % (
+            self.kind, self.name, self.mapper, self.module)
+
+
+_importHooks = []
+
+def addImportHook(hook):
+    """
+    Register a callable to be notified of L{ImportEvent}s.
+
+    Events are only constructed while at least one hook is registered, so
+    there is no cost to them otherwise.
+
+    @param hook: A callable taking an L{ImportEvent}.
+    """
+    _importHooks.append(hook)
+
+
+def removeImportHook(hook):
+    """
+    Stop notifying a hook previously registered with L{addImportHook}.
+    """
+    _importHooks.remove(hook)
+
+
+def _emit(kind, name, mapper, module=None):
+    event = ImportEvent(kind, name, mapper, module)
+    for hook in list(_importHooks):
+        hook(event)
+
+
+def printImportEvent(event):
+    """
+    An import hook that prints every event, for debugging.
+    """
+    print event
+
+
+_nothing = object()
+
+# The contents of sys.modules displaced by each active call to
+# _isolateImports, innermost last.
+_isolatedSysModules = []
+
+def _outerSysModules():
+    """
+    Return the global module table displaced by the outermost active
+    isolation, or C{None} if imports aren't currently isolated. (Isolations
+    nested in it, as when a mapper loads modules itself, displace isolated
+    tables.)
+    """
+    if _isolatedSysModules:
+        return _isolatedSysModules[0]
+    return None
+
+
+_trieValue = object()
+
+class _NameTrie(object):
+    """
+    A mapping of dotted names to values that can find the entry for a name or
+    for the closest package containing it, in time proportional to the depth
+    of the name rather than the number of entries.
+    """
+
+    def __init__(self, items=()):
+        self._root = {}
+        for name, value in items:
+            self[name] = value
+
+
+    def __setitem__(self, name, value):
+        node = self._root
+        for part in name.split('.'):
+            node = node.setdefault(part, {})
+        node[_trieValue] = value
+
+
+    def longestPrefix(self, name):
+        """
+        Find the entry for C{name} or for its closest enclosing package.
+
+        @param name: A dotted name.
+
+        @returns: A C{(prefix, value)} tuple, where C{prefix} is the name of
+        the entry found, or C{None} if there is no such entry.
+        """
+        node = self._root
+        parts = name.split('.')
+        found = None
+        for i, part in enumerate(parts):
+            node = node.get(part)
+            if node is None:
+                break
+            if _trieValue in node:
+                found = (i + 1, node[_trieValue])
+        if found is None:
+            return None
+        return ('.'.join(parts[:found[0]]), found[1])
+
+
+
+class _Exclusions(object):
+    """
+    The names blacklisted by one or more L{ExclusiveMapper}s.
+
+    @ivar names: Names that are excluded exactly.
+    @ivar subtrees: Names that are excluded along with all of their
+    submodules.
+    """
+
+    def __init__(self, names=(), subtrees=()):
+        self.names = frozenset(names)
+        self.subtrees = frozenset(subtrees)
+        self._trie = _NameTrie((name, True) for name in self.subtrees)
+
+
+    def __or__(self, other):
+        return _Exclusions(self.names | other.names,
+                           self.subtrees | other.subtrees)
+
+
+    def __contains__(self, name):
+        return (name in self.names
+                or self._trie.longestPrefix(name) is not None)
+
+_noExclusions = _Exclusions()
+
 
 
 class IMapper(Interface):
@@ -83,13 +243,28 @@ class CallableMapper(object):
         return _StackedMapper([DictMapper(overrides), self])
 
 
+    def _leaves(self, excluded):
+        """
+        @see L{flattenMapper}
+        """
+        return [(excluded, self)]
+
+
 class DictMapper(object):
     """
     A mapper that looks up names in a dictionary or other mapping.
+
+    If C{subtrees} is true, each key also covers the submodules of the package
+    it names: looking up C{"a.b.c"} when only C{"a"} is a key returns the
+    C{b.c} attribute of C{"a"}'s value. The set of keys is fixed when the
+    mapper is created in this case.
     """
     implements(IMapper)
-    def __init__(self, _dict):
+    def __init__(self, _dict, subtrees=False):
         self._dict = _dict
+        self._subtrees = None
+        if subtrees:
+            self._subtrees = _NameTrie((name, name) for name in _dict.keys())
 
 
     def lookup(self, name):
@@ -97,17 +272,32 @@ class DictMapper(object):
         @see L{IMapper.lookup}
         """
         if name in self._dict:
-            trace("DictMapper imported %s as %s" % (name, self._dict[name]))
             return self._dict[name]
-        else:
-            raise ImportError("No module named %r in mapper %r" % (name, self))
+        if self._subtrees is not None:
+            found = self._subtrees.longestPrefix(name)
+            if found is not None:
+                m = self._dict[found[0]]
+                try:
+                    for p in name[len(found[0]) + 1:].split('.'):
+                        m = getattr(m, p)
+                except AttributeError:
+                    pass
+                else:
+                    return m
+        raise ImportError("No module named %r in mapper %r" % (name, self))
 
 
     def contains(self, name):
         """
         @see L{IMapper.contains}
         """
-        return name in self._dict
+        if self._subtrees is None:
+            return name in self._dict
+        try:
+            self.lookup(name)
+            return True
+        except ImportError:
+            return False
 
 
     def withOverrides(self, overrides):
@@ -117,6 +307,13 @@ class DictMapper(object):
         return _StackedMapper([DictMapper(overrides), self])
 
 
+    def _leaves(self, excluded):
+        """
+        @see L{flattenMapper}
+        """
+        return [(excluded, self)]
+
+
 
 class _StackedMapper(object):
     """
@@ -159,19 +356,32 @@ class _StackedMapper(object):
         return _StackedMapper([DictMapper(overrides), self])
 
 
+    def _leaves(self, excluded):
+        """
+        @see L{flattenMapper}
+        """
+        leaves = []
+        for m in self._submappers:
+            leaves.extend(_mapperLeaves(m, excluded))
+        return leaves
+
+
 
 class ExclusiveMapper(object):
     """
     A mapper that wraps another mapper, but excludes certain names.
 
-    This mapper can be used to implement a blacklist.
+    This mapper can be used to implement a blacklist. If C{subtrees} is true,
+    excluding a package also excludes all of its submodules.
     """
 
     implements(IMapper)
 
-    def __init__(self, submapper, excluded):
+    def __init__(self, submapper, excluded, subtrees=False):
         self._submapper = submapper
         self._excluded = excluded
+        if subtrees:
+            self._excluded = _Exclusions(subtrees=excluded)
 
 
     def lookup(self, name):
@@ -202,6 +412,153 @@ class ExclusiveMapper(object):
         return _StackedMapper([DictMapper(overrides), self])
 
 
+    def _leaves(self, excluded):
+        """
+        @see L{flattenMapper}
+        """
+        if isinstance(self._excluded, _Exclusions):
+            return _mapperLeaves(self._submapper, excluded | self._excluded)
+        return _mapperLeaves(self._submapper,
+                             excluded | _Exclusions(self._excluded))
+
+
+
+def _mapperLeaves(mapper, excluded=_noExclusions):
+    """
+    Decompose a mapper into the sequence of mappers it consults, in order.
+
+    @param mapper: An L{IMapper} provider.
+    @param excluded: An L{_Exclusions} of names that are blacklisted for
+    C{mapper}.
+
+    @returns: A list of C{(excluded, leaf)} pairs, where C{leaf} is a mapper
+    that cannot be decomposed further and C{excluded} is the L{_Exclusions}
+    of names it must not be asked about.
+    """
+    leaves = getattr(mapper, '_leaves', None)
+    if leaves is None:
+        return [(excluded, mapper)]
+    return leaves(excluded)
+
+
+
+class _FlatMapper(object):
+    """
+    A mapper equivalent to a stack of other mappers, compiled by
+    L{flattenMapper} into a single override table, a single set of excluded
+    names and a single fallback mapper.
+
+    @ivar _table: A dict of all names provided by leading L{DictMapper}s.
+    @ivar _excluded: An L{_Exclusions} of names the fallback mapper must not
+    be asked about.
+    @ivar _fallback: The first mapper in the stack that isn't a plain
+    L{DictMapper}, or C{None}.
+    @ivar _rest: C{(excluded, mapper)} pairs consulted, in order, if the
+    fallback can't resolve a name.
+    """
+
+    implements(IMapper)
+
+    def __init__(self, table, excluded, fallback, rest):
+        self._table = table
+        self._excluded = excluded
+        self._fallback = fallback
+        self._rest = rest
+
+
+    def lookup(self, name):
+        """
+        @see L{IMapper.lookup}
+        """
+        if name in self._table:
+            return self._table[name]
+        if self._fallback is not None:
+            if name in self._excluded:
+                e = ImportError("Module %s blacklisted in mapper %s"
+                                % (name, self))
+            else:
+                try:
+                    return self._fallback.lookup(name)
+                except ImportError, e:
+                    pass
+            for excluded, m in self._rest:
+                if name in excluded:
+                    continue
+                try:
+                    return m.lookup(name)
+                except ImportError:
+                    continue
+            raise e
+        raise ImportError("No module named %r in mapper %r" % (name, self))
+
+
+    def contains(self, name):
+        """
+        @see L{IMapper.contains}
+        """
+        try:
+            self.lookup(name)
+            return True
+        except ImportError:
+            return False
+
+
+    def withOverrides(self, overrides):
+        """
+        @see L{IMapper.withOverrides}
+        """
+        table = dict(self._table)
+        table.update(overrides)
+        return _FlatMapper(table, self._excluded, self._fallback, self._rest)
+
+
+    def _leaves(self, excluded):
+        """
+        @see L{flattenMapper}
+        """
+        leaves = [(excluded, DictMapper(self._table))]
+        if self._fallback is not None:
+            leaves.append((excluded | self._excluded, self._fallback))
+        for restExcluded, m in self._rest:
+            leaves.append((excluded | restExcluded, m))
+        return leaves
+
+
+
+def flattenMapper(mapper):
+    """
+    Compile a mapper, and any mappers it wraps, into a single mapper with the
+    same lookup semantics.
+
+    Mappers built with C{withOverrides} consult each layer in turn, so a deep
+    stack costs one lookup per layer. The flattened mapper merges every
+    leading exact-name L{DictMapper} into one table and precomputes the names
+    excluded by L{ExclusiveMapper}s, so resolution is a single dict lookup
+    before falling back to the first mapper that isn't a dict (usually
+    L{pep302Mapper}). Calling C{withOverrides} on the result returns another
+    flattened mapper.
+
+    The contents of any L{DictMapper}s are copied; later changes to the
+    wrapped dicts are not seen by the flattened mapper.
+
+    @param mapper: An L{IMapper} provider.
+
+    @returns: An L{IMapper} provider.
+    """
+    leaves = _mapperLeaves(mapper)
+    table = {}
+    while (leaves and isinstance(leaves[0][1], DictMapper)
+           and leaves[0][1]._subtrees is None):
+        excluded, dm = leaves.pop(0)
+        for name in dm._dict.keys():
+            if name not in table and name not in excluded:
+                table[name] = dm._dict[name]
+    if not leaves:
+        return _FlatMapper(table, _noExclusions, None, [])
+    excluded, fallback = leaves.pop(0)
+    return _FlatMapper(table, excluded, fallback, leaves)
+
+
 
 def _noLookup(name):
     raise ImportError(name)
@@ -210,40 +567,70 @@ class _PEP302Mapper(CallableMapper):
     """
     Mapper that uses Python's default import mechanism to load modules.
 
-    @cvar _oldSysModules: Set by L{_isolateImports} when clearing
-    L{sys.modules} to its former contents.
-    """
+    Modules imported this way end up in the global L{sys.modules}, so once a
+    name has been resolved the result is cached and later lookups of it don't
+    touch the global import state at all. The cache holds at most
+    C{cacheSize} names, discarding the least recently used ones first; use
+    L{flushCache} if a module is reloaded or removed from L{sys.modules}.
 
-    _oldSysModules = {}
+    @ivar _resolved: An ordered dict mapping fully-qualified names to the
+    objects previously resolved for them, least recently used first.
+    """
 
-    def __init__(self):
+    def __init__(self, cacheSize=1024):
         self._metaPath = list(sys.meta_path)
+        self._resolved = OrderedDict()
+        self.cacheSize = cacheSize
+
+
+    def flushCache(self, *names):
+        """
+        Forget previously resolved names, so that they are imported again the
+        next time they are looked up.
+
+        @param names: The fully-qualified names to forget. Names of packages
+        also forget all of their submodules. If none are given, the whole
+        cache is emptied.
+        """
+        if not names:
+            self._resolved.clear()
+        for name in names:
+            prefix = name + '.'
+            for key in self._resolved.keys():
+                if key == name or key.startswith(prefix):
+                    del self._resolved[key]
 
 
     def _baseLookup(self, name):
+        if name in self._resolved:
+            m = self._resolved.pop(name)
+            self._resolved[name] = m
+            return m
+        outerModules = _outerSysModules()
         try:
             prevImport = __import__
             prevMetaPath = list(sys.meta_path)
-            prevSysModules = sys.modules.copy()
             __builtins__['__import__'] = prevImport
             sys.meta_path[:] = self._metaPath
-            sys.modules.clear()
-            sys.modules.update(self._oldSysModules)
-            topLevel = _originalImport(name)
-            trace("pep302Mapper imported %r as %r@%d" % (name, topLevel, id(topLevel)))
-            packages = name.split(".")[1:]
-            m = topLevel
-            trace("subelements:", packages)
-            for p in packages:
-                trace("getattr", m, p)
+            if outerModules is not None:
+                prevSysModules = sys.modules.copy()
+                sys.modules.clear()
+                sys.modules.update(outerModules)
+            m = _originalImport(name)
+            for p in name.split(".")[1:]:
                 m = getattr(m, p)
-            trace("done:", m, id(m))
+            self._resolved[name] = m
+            while len(self._resolved) > self.cacheSize:
+                self._resolved.popitem(last=False)
             return m
         finally:
-            self._oldSysModules.update(sys.modules)
+            if outerModules is not None:
+                # Anything imported here was imported globally; make sure it
+                # survives when the isolated import state is torn down.
+                outerModules.update(sys.modules)
+                sys.modules.clear()
+                sys.modules.update(prevSysModules)
             sys.meta_path[:] = prevMetaPath
-            sys.modules.clear()
-            sys.modules.update(prevSysModules)
             __builtins__['__import__'] = prevImport
 
 
@@ -253,13 +640,14 @@ pep302Mapper = _PEP302Mapper()
 def lookupWithMapper(mapper, fqn):
     """
     Look up a FQN in a mapper, logging all non-ImportError exceptions and
-    converting them to ImportErrors.
+    converting them to ImportErrors. Exceptions which aren't L{Exception}s,
+    such as L{KeyboardInterrupt}, are raised unchanged.
     """
     try:
         return mapper.lookup(fqn)
     except ImportError, e:
         raise e
-    except:
+    except Exception:
         print "Error raised by Exocet mapper while loading %r" % (fqn)
         traceback.print_exc()
         raise ImportError(fqn)
@@ -292,10 +680,84 @@ class MakerFinder(object):
 
     @ivar oldImport: the implementation of C{__import__} being wrapped by this
                      object's C{xocImport} method.
+
+    @ivar cache: A L{ModuleCache} consulted for modules already loaded with
+                 C{mapper}, or C{None}.
+
+    @ivar _displaced: C{(package, name, value)} tuples recording attributes
+                      of packages that are replaced by the import system
+                      when it imports a cached module; restored by
+                      L{_isolateImports} once the import is done.
+
+    @ivar _localImports: A dict mapping the arguments of function-level
+                         imports made by modules loaded with this finder to
+                         their results. See L{redirectLocalImports}.
     """
-    def __init__(self, oldImport, mapper):
+    def __init__(self, oldImport, mapper, cache=None):
         self.mapper = mapper
         self.oldImport = oldImport
+        self.cache = cache
+        self._displaced = []
+        self._localImports = {}
+
+
+    def _lookup(self, fqn):
+        """
+        Find a module in our cache, or else in our mapper.
+        """
+        if self.cache is not None:
+            p = self.cache.getNamed(fqn, self.mapper)
+            if p is not None:
+                self._displace(fqn)
+                return p
+        return lookupWithMapper(self.mapper, fqn)
+
+
+    def _reportedLookup(self, fqn):
+        """
+        Find a module like L{_lookup}, telling any import hooks about it.
+        """
+        if not _importHooks:
+            return self._lookup(fqn)
+        _emit(LOOKUP, fqn, self.mapper)
+        try:
+            p = self._lookup(fqn)
+        except ImportError:
+            _emit(MISS, fqn, self.mapper)
+            raise
+        _emit(HIT, fqn, self.mapper, p)
+        return p
+
+
+    def _displace(self, fqn):
+        """
+        Prepare for Python setting an isolated module as an attribute of its
+        package, which may well be the real, global one, by remembering the
+        attribute's current value.
+
+        @param fqn: The fully-qualified name of the isolated module.
+        """
+        parentName, _, name = fqn.rpartition('.')
+        if parentName:
+            parent = self._lookup(parentName)
+            self._displaced.append(
+                (parent, name, getattr(parent, name, _nothing)))
+
+
+    def _restoreDisplaced(self):
+        """
+        Undo changes to package attributes made while importing cached
+        modules.
+        """
+        while self._displaced:
+            parent, name, value = self._displaced.pop()
+            try:
+                if value is _nothing:
+                    delattr(parent, name)
+                else:
+                    setattr(parent, name, value)
+            except AttributeError:
+                pass
 
 
     def find_module(self, fullname, path=None):
@@ -305,7 +767,6 @@ class MakerFinder(object):
         @param fullname: The name of the module/package being imported.
         @param path: The __path__ attribute of the package, if applicable.
         """
-        trace("find_module", fullname, path)
         return self
 
 
@@ -315,10 +776,7 @@ class MakerFinder(object):
 
         @param fqn: The fully-qualified name of the module requested.
         """
-        trace("load_module", fqn)
-        trace("sys.modules", sys.modules)
-        p = lookupWithMapper(self.mapper, fqn)
-        trace("load_module", fqn, "done", id(p))
+        p = self._reportedLookup(fqn)
 
         if fqn in _sysModulesSpecialCases:
         # This module didn't have access to our isolated sys.modules when it
@@ -334,9 +792,7 @@ class MakerFinder(object):
         Wrapper around C{__import__}. Needed to ensure builtin modules aren't
         loaded from the global context.
         """
-        trace("Import invoked:", name, kwargs.keys())
         if name in sys.builtin_module_names:
-            trace("Loading builtin module", name)
             return self.load_module(name)
         else:
             return self.oldImport(name, *args, **kwargs)
@@ -344,7 +800,126 @@ class MakerFinder(object):
 
 
 
-def loadNamed(fqn, mapper, m=None):
+def modificationTime(filePath):
+    """
+    Get the current modification time of a FilePath-like object, or C{None}
+    if it can't be determined, as for a member of a bundle or zip file that
+    has gone away.
+    """
+    changed = getattr(filePath, 'changed', None)
+    if changed is not None:
+        changed()
+    try:
+        return filePath.getModificationTime()
+    except (OSError, IOError, KeyError):
+        return None
+
+
+
+class ModuleCache(object):
+    """
+    A cache of modules loaded by L{load}, so that loading the same module with
+    the same mapper again returns the module that was already loaded instead
+    of executing it again.
+
+    Entries are keyed by the module's path and the identity of the mapper,
+    and are discarded when the module's source has been modified since it was
+    loaded. Modules loaded through the cache can also import each other:
+    importing the name of a cached module loaded with the same mapper returns
+    the cached module rather than asking the mapper for it.
+
+    @ivar _modules: A dict mapping C{(path, id(mapper))} to
+    C{(mapper, filePath, mtime, module)} tuples.
+
+    @ivar _names: A dict mapping C{(fqn, id(mapper))} to the path the named
+    module was loaded from.
+    """
+
+    def __init__(self):
+        self._modules = {}
+        self._names = {}
+
+
+    def get(self, maker, mapper):
+        """
+        Retrieve a module previously loaded with a mapper.
+
+        @param maker: A L{modules.PythonModule} instance.
+        @param mapper: A L{Mapper}.
+
+        @returns: The loaded module, or C{None} if it isn't cached or its
+        source has changed since.
+        """
+        return self._get(maker.filePath.path, mapper)
+
+
+    def getNamed(self, fqn, mapper):
+        """
+        Retrieve a module previously loaded with a mapper, by name.
+
+        @param fqn: The fully qualified name of a Python module.
+        @param mapper: A L{Mapper}.
+
+        @returns: The loaded module, or C{None} if it isn't cached or its
+        source has changed since.
+        """
+        path = self._names.get((fqn, id(mapper)))
+        if path is None:
+            return None
+        return self._get(path, mapper)
+
+
+    def _get(self, path, mapper):
+        key = (path, id(mapper))
+        entry = self._modules.get(key)
+        if entry is None:
+            return None
+        cachedMapper, filePath, mtime, m = entry
+        if cachedMapper is not mapper:
+            return None
+        if modificationTime(filePath) != mtime:
+            del self._modules[key]
+            return None
+        return m
+
+
+    def add(self, maker, mapper, m):
+        """
+        Remember a module loaded with a mapper.
+
+        @param maker: The L{modules.PythonModule} instance C{m} was loaded
+        from.
+        @param mapper: The L{Mapper} C{m} was loaded with.
+        @param m: The loaded module.
+        """
+        path = maker.filePath.path
+        self._modules[path, id(mapper)] = (
+            mapper, maker.filePath, modificationTime(maker.filePath), m)
+        self._names[maker.name, id(mapper)] = path
+
+
+    def invalidate(self, *makers):
+        """
+        Forget loaded modules, so that they are executed again the next time
+        they are loaded.
+
+        @param makers: The L{modules.PythonModule} instances to forget, for
+        all mappers. If none are given, the whole cache is emptied.
+        """
+        if not makers:
+            self._modules.clear()
+            self._names.clear()
+        paths = set(maker.filePath.path for maker in makers)
+        for key in self._modules.keys():
+            if key[0] in paths:
+                del self._modules[key]
+        for key, path in self._names.items():
+            if path in paths:
+                del self._names[key]
+
+
+
+def loadNamed(fqn, mapper, m=None, resolveImports=False, cache=None):
     """
     Load a Python module, eliminating as much of its access to global state as
     possible. If a package name is given, its __init__.py is loaded.
@@ -357,13 +932,18 @@ def loadNamed(fqn, mapper, m=None):
     @param m: An optional empty module object to load code into. (For
     resolving circular module imports.)
 
+    @param resolveImports: See L{load}.
+
+    @param cache: See L{load}.
+
     @returns: An instance of the module name requested.
     """
     maker = getModule(fqn)
-    return load(maker, mapper, m=m)
+    return load(maker, mapper, m=m, resolveImports=resolveImports,
+                cache=cache)
 
 
-def load(maker, mapper, m=None):
+def load(maker, mapper, m=None, resolveImports=False, cache=None):
     """
     Load a Python module, eliminating as much of its access to global state as
     possible. If a package name is given, its __init__.py is loaded.
@@ -375,21 +955,102 @@ def load(maker, mapper, m=None):
     @param m: An optional empty module object to load code into. (For
     resolving circular module imports.)
 
+    @param resolveImports: If true, look up every name the module imports at
+    its top level in C{mapper} before running any of its code, so that a
+    module importing something blacklisted or missing fails without side
+    effects. This also warms any cache in C{mapper}. Modules that can't be
+    statically analyzed are loaded as usual.
+
+    @param cache: An optional L{ModuleCache}. If the module was already
+    loaded with C{mapper} through this cache, and hasn't changed since, the
+    previously loaded module is returned.
+
+    @raise ImportError: if C{resolveImports} is true and the mapper can't
+    provide one of the module's imports.
+
     @returns: An instance of the module name requested.
     """
-    mf = MakerFinder(__builtin__.__import__, mapper)
+    if cache is not None and m is None:
+        cached = cache.get(maker, mapper)
+        if cached is not None:
+            return cached
+    mf = MakerFinder(__builtin__.__import__, mapper, cache)
     if maker.filePath.splitext()[1] in [".so", ".pyd"]:
         #it's native code, gotta suck it up and load it globally (really at a
         ## loss on how to unit test this without significant inconvenience)
         return maker.load()
-    return _isolateImports(mf, _loadSingle, maker, mf, m)
+    if m is None:
+        m = ExocetModule(maker.name)
+    if _importHooks:
+        _emit(LOAD_START, maker.name, mapper, m)
+    try:
+        if resolveImports:
+            m = _isolateImports(mf, _resolveAndLoad, maker, mf, m)
+        else:
+            m = _isolateImports(mf, _loadSingle, maker, mf, m)
+    finally:
+        if _importHooks:
+            _emit(LOAD_END, maker.name, mapper, m)
+    if cache is not None:
+        cache.add(maker, mapper, m)
+    return m
+
+def _resolveImports(mk, lookup):
+    """
+    Look up all the names a module imports at its top level, the same way
+    executing its import statements would.
+
+    @param mk: A L{modules._modules.PythonModule} object.
+    @param lookup: A callable taking a fully-qualified name and returning
+    the module that importing it would, or raising C{ImportError}; the
+    lookup method of the importer the module will be executed with, so that
+    its cache is used and its import hooks are told.
+    """
+    try:
+        required = list(mk.iterRequiredImports())
+    except (NotImplementedError, ValueError, SyntaxError):
+        # Not analyzable (or not valid); leave it to the real execution.
+        return
+    for source, name in required:
+        if source is None:
+            source, name = name, None
+        parts = source.split('.')
+        try:
+            for i in range(len(parts)):
+                p = lookup('.'.join(parts[:i + 1]))
+            if name is not None and not hasattr(p, name):
+                lookup(source + '.' + name)
+        except ImportError, e:
+            raise ImportError("%s cannot be loaded: %s" % (mk.name, e))
+
+def _resolveAndLoad(mk, mf, m=None):
+    _resolveImports(mk, mf._reportedLookup)
+    return _loadSingle(mk, mf, m)
+
+def _compileModule(filePath):
+    """
+    Get the code object for a module from any FilePath-like object, such as
+    a L{ZipPath}: by compiling its source, or by unmarshalling it if it's a
+    compiled module.
+
+    @param filePath: The FilePath-like object for the module's source, or
+    its C{.pyc}/C{.pyo} file.
+
+    @raise ImportError: if a compiled module is for another Python version.
+    """
+    content = filePath.getContent()
+    if filePath.splitext()[1] in ('.pyc', '.pyo'):
+        if content[:4] != imp.get_magic():
+            raise ImportError("Bad magic number in %s" % (filePath.path,))
+        return marshal.loads(content[8:])
+    return compile(content, filePath.path, 'exec')
+
 
 def _loadSingle(mk, mf, m=None):
-    trace("execfile", mk.name, m)
     if m is None:
         m = ExocetModule(mk.name)
     contents = {}
-    code = execfile(mk.filePath.path, contents)
+    exec _compileModule(mk.filePath) in contents
     contents['__exocet_context__'] = mf
     m.__dict__.update(contents)
     m.__file__ = mk.filePath.path
@@ -410,7 +1071,8 @@ def _isolateImports(mf, f, *a, **kw):
 
     oldMetaPath = sys.meta_path
     oldPathHooks = sys.path_hooks
-    _PEP302Mapper._oldSysModules = sys.modules.copy()
+    oldSysModules = sys.modules.copy()
+    _isolatedSysModules.append(oldSysModules)
     oldImport = __builtin__.__import__
     #where is your god now?
     sys.path_hooks = []
@@ -418,29 +1080,147 @@ def _isolateImports(mf, f, *a, **kw):
     sys.meta_path = [mf]
     __builtins__['__import__'] = mf.xocImport
 
-
-
-    #stupid special case for the stdlib
-    if mf.mapper.contains('warnings'):
-        sys.modules['warnings'] = mf.mapper.lookup('warnings')
-
     try:
-       return f(*a, **kw)
+        #stupid special case for the stdlib
+        if mf.mapper.contains('warnings'):
+            sys.modules['warnings'] = mf.mapper.lookup('warnings')
+        return f(*a, **kw)
     finally:
         sys.meta_path = oldMetaPath
         sys.path_hooks = oldPathHooks
         sys.modules.clear()
-        sys.modules.update(_PEP302Mapper._oldSysModules)
+        sys.modules.update(oldSysModules)
+        _isolatedSysModules.pop()
+        mf._restoreDisplaced()
         __builtins__['__import__'] = oldImport
 
 
-def _buildAndStoreEmptyModule(maker, mapper):
-    m = ModuleType(maker.name)
-    m.__path__ = maker.filePath.path
-    mapper.add(maker.name, m)
+def _buildAndStoreEmptyModule(maker, namespace):
+    """
+    Create the placeholder module a module's code will be loaded into, and
+    make it available to imports straight away (for resolving circular module
+    imports).
+
+    @param maker: A L{modules.PythonModule} instance.
+    @param namespace: A dict mapping module names to modules.
+    """
+    m = ExocetModule(maker.name)
+    if maker.isPackage():
+        m.__path__ = [maker.filePath.parent().path]
+    namespace[maker.name] = m
     return m
 
 
+
+class _PackageMapper(object):
+    """
+    A mapper that provides the modules of a package by loading them, once
+    each, into a shared namespace, and defers all other names to another
+    mapper.
+
+    @ivar _makers: A dict mapping the names of the package's modules to
+    L{modules.PythonModule} instances.
+    @ivar _namespace: A dict mapping the names of the modules loaded so far,
+    or being loaded, to module objects.
+    @ivar _submapper: The L{IMapper} provider used for all other names.
+    @ivar _finder: The L{MakerFinder} the package's modules are loaded with.
+    @ivar _packageName: The name of the package.
+    """
+
+    implements(IMapper)
+
+    def __init__(self, packageName, makers, submapper):
+        self._packageName = packageName
+        self._makers = makers
+        self._namespace = {}
+        self._submapper = submapper
+        self._finder = MakerFinder(__builtin__.__import__, self)
+
+
+    def lookup(self, name):
+        """
+        @see L{IMapper.lookup}
+        """
+        if name == self._packageName:
+            self._finder._displace(name)
+        if name in self._namespace:
+            return self._namespace[name]
+        if name in self._makers:
+            return self._load(self._makers[name])
+        return self._submapper.lookup(name)
+
+
+    def contains(self, name):
+        """
+        @see L{IMapper.contains}
+        """
+        if name in self._namespace or name in self._makers:
+            return True
+        return self._submapper.contains(name)
+
+
+    def withOverrides(self, overrides):
+        """
+        @see L{IMapper.withOverrides}
+        """
+        return _StackedMapper([DictMapper(overrides), self])
+
+
+    def _load(self, maker):
+        """
+        Load one of the package's modules into the namespace. Must be called
+        with imports isolated by our finder.
+        """
+        m = _buildAndStoreEmptyModule(maker, self._namespace)
+        if _importHooks:
+            _emit(LOAD_START, maker.name, self, m)
+        try:
+            _loadSingle(maker, self._finder, m)
+        except:
+            del self._namespace[maker.name]
+            raise
+        finally:
+            if _importHooks:
+                _emit(LOAD_END, maker.name, self, m)
+        parentName, _, name = maker.name.rpartition('.')
+        if parentName in self._namespace:
+            setattr(self._namespace[parentName], name, m)
+        return m
+
+
+    def _loadAll(self):
+        """
+        Load every module in the package that hasn't been loaded yet.
+        """
+        for name in sorted(self._makers):
+            if name not in self._namespace:
+                self._load(self._makers[name])
+        return self._namespace[self._packageName]
+
+
+
+def loadPackage(maker, mapper):
+    """
+    Load a package and all of its modules and subpackages into a single
+    isolated namespace.
+
+    Each module is executed exactly once. Imports of the package's modules
+    from within the package, including circular ones, are resolved from the
+    namespace instead of C{mapper}; a module that is imported while it is
+    still being loaded is provided as the partially-loaded module.
+
+    @param maker: A L{modules.PythonModule} instance for a package.
+
+    @param mapper: A L{Mapper} used for all names outside the package.
+
+    @returns: The package's module, with its submodules loaded as
+    attributes.
+    """
+    makers = dict((pm.name, pm) for pm in maker.walkModules())
+    pm = _PackageMapper(maker.name, makers, mapper)
+    return _isolateImports(pm._finder, pm._loadAll)
+
+
 def proxyModule(original, **replacements):
     """
     Create a proxy for a module object, overriding some of its attributes with
@@ -465,22 +1245,75 @@ def proxyModule(original, **replacements):
     return _ModuleProxy()
 
 
+def cachedProxyModule(original, **replacements):
+    """
+    Create a proxy for a module object, like L{proxyModule}, that copies the
+    original module's attributes up front instead of looking them up on every
+    access. Attribute access on the proxy costs the same as on a normal module.
+
+    Changes made to the original module afterwards aren't visible through the
+    proxy until L{refreshProxy} is called.
+
+    @param original: A module.
+    @param replacements: Attribute names and objects to associate with them.
 
+    @returns: A module with the original module's attributes, and the
+    replacement objects.
+    """
+    class _CachedModuleProxy(ModuleType):
+        _exocetOriginal = original
+        _exocetReplacements = replacements
+
+        def __repr__(self):
+            return "<Cached proxy for %r: %s replaced>" % (
+                original, ', '.join(replacements.keys()))
+    proxy = _CachedModuleProxy(original.__name__)
+    refreshProxy(proxy)
+    return proxy
 
-def redirectLocalImports(name, globals=None, *a, **kw):
+
+def refreshProxy(proxy):
+    """
+    Copy the current attributes of the original module into a proxy created
+    by L{cachedProxyModule}. Attributes since removed from the original are
+    removed from the proxy as well.
+
+    @param proxy: A proxy returned by L{cachedProxyModule}.
+    """
+    namespace = proxy.__dict__
+    namespace.clear()
+    namespace.update(vars(proxy._exocetOriginal))
+    namespace.update(proxy._exocetReplacements)
+
+
+
+
+def redirectLocalImports(name, globals=None, locals=None, fromlist=None,
+                         level=-1):
     """
     Catch function-level imports in modules loaded via Exocet. This ensures
     that any imports done after module load time look up imported names in the
     same context the module was originally loaded in.
+
+    Results are remembered by the module's exocet context, so repeating an
+    import that has already succeeded doesn't touch the global import state.
     """
     if globals is not None:
         mf = globals.get('__exocet_context__', None)
         if mf is not None:
-            trace("isolated __import__ of", name,  "called in exocet module", mf, mf.mapper)
-            return _isolateImports(mf, _originalImport, name, globals, *a, **kw)
+            key = (name, tuple(fromlist or ()), level,
+                   globals.get('__name__'), globals.get('__package__'))
+            try:
+                return mf._localImports[key]
+            except KeyError:
+                pass
+            m = _isolateImports(mf, _originalImport, name, globals, locals,
+                                fromlist, level)
+            mf._localImports[key] = m
+            return m
         else:
-            return _originalImport(name, globals, *a, **kw)
+            return _originalImport(name, globals, locals, fromlist, level)
     else:
-        return _originalImport(name, globals, *a, **kw)
+        return _originalImport(name, globals, locals, fromlist, level)
 
 _originalImport = __builtin__.__import__
@@ -56,22 +56,38 @@ the modules outside the standard library's python-files directory::
 __metaclass__ = type
 
 # let's try to keep path imports to a minimum...
-from os.path import dirname, split as splitpath
+from os.path import dirname, split as splitpath, splitext, isdir
+from os.path import exists as pathExists, join as joinpath
+from os import listdir, stat
 
 import sys
+import marshal
+from multiprocessing.pool import ThreadPool
+from Queue import Queue
 import zipimport
 import inspect
 import warnings
 import re
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import sha as sha1
 try:
     import ast
 except ImportError:
     ast = None
+try:
+    from os import scandir as _scandir
+except ImportError:
+    try:
+        from scandir import scandir as _scandir
+    except ImportError:
+        _scandir = None
 
 from zope.interface import Interface, implements
 
 from exocet._filepath import UnlistableError, FilePath
-from exocet._zippath import  ZipArchive
+from exocet._zippath import  ZipArchive, ZipPath
 
 from exocet._reflect import namedAny
 from exocet._components import registerAdapter
@@ -87,6 +103,8 @@ else:
     PYTHON_EXTENSIONS.append('.pyc')
 PYTHON_EXTENSIONS.extend([".so", ".pyd"])
 
+_identifier = re.compile('[a-zA-Z_][a-zA-Z0-9_]*$')
+
 def _isPythonIdentifier(string):
     """
     cheezy fake test for proper identifier-ness.
@@ -98,11 +116,130 @@ def _isPythonIdentifier(string):
     if string == '':
         return True
     try:
-        return re.match('[a-zA-Z_][a-zA-Z0-9_]*$', string) is not None
+        return _identifier.match(string) is not None
     except TypeError:
         return False
 
 
+def _listDirectory(directory):
+    """
+    List a directory with a single read, along with whatever the read says
+    about the type of each entry.
+
+    @param directory: A L{FilePath}.
+
+    @raise UnlistableError: if the directory doesn't exist or isn't a
+    directory, as for L{FilePath.children}.
+
+    @return: a list of C{(name, isDirectory, isLink)} triples, sorted by
+    name, where C{isDirectory} and C{isLink} are callables which only make a
+    system call when the listing didn't say.  C{isLink} returns C{None} when
+    it can't tell.
+    """
+    try:
+        if _scandir is not None:
+            return sorted((entry.name, entry.is_dir, entry.is_symlink)
+                          for entry in _scandir(directory.path))
+        names = listdir(directory.path)
+    except OSError:
+        # Let FilePath decide which errors mean there's nothing to list.
+        directory.children()
+        raise
+    path = directory.path
+    names.sort()
+    return [(name, lambda child=joinpath(path, name): isdir(child),
+             lambda: None)
+            for name in names]
+
+
+def _findPackageInit(directory):
+    """
+    Find the C{__init__} module of a package directory from a listing of the
+    directory, rather than by probing for each possible file.
+
+    @param directory: A L{FilePath}.
+
+    @return: The L{FilePath} of the C{__init__} module, or C{None} if
+    C{directory} isn't a package.
+    """
+    try:
+        entries = dict((name, isLink)
+                       for (name, isDirectory, isLink)
+                       in _listDirectory(directory))
+    except OSError:
+        # Directories which can be searched but not read can still be
+        # packages.
+        for ext in PYTHON_EXTENSIONS:
+            initpy = directory.child("__init__" + ext)
+            if initpy.exists():
+                return initpy
+        return None
+    for ext in PYTHON_EXTENSIONS:
+        isLink = entries.get("__init__" + ext)
+        if isLink is None:
+            continue
+        initpy = directory.child("__init__" + ext)
+        # A dangling symlink is listed, but doesn't exist.
+        if isLink() is False or initpy.exists():
+            return initpy
+    return None
+
+
+def _moduleCandidates(directory):
+    """
+    Find the files and directories in a directory which could be modules or
+    packages.
+
+    @param directory: A FilePath-like object.
+
+    @raise UnlistableError: if C{directory} can't be listed.
+
+    @return: a list of C{(name, filePath, isPackage)} triples in file name
+    order, where C{filePath} is the module's file, or its C{__init__} file
+    for a package.
+    """
+    candidates = []
+    if isinstance(directory, FilePath):
+        for name, isDirectory, isLink in _listDirectory(directory):
+            ext = splitext(name)[1]
+            if ext in PYTHON_EXTENSIONS:
+                candidates.append(
+                    (name[:-len(ext)], directory.child(name), False))
+            elif not ext and isDirectory():
+                initpy = _findPackageInit(directory.child(name))
+                if initpy is not None:
+                    candidates.append((name, initpy, True))
+        return candidates
+
+    children = directory.children()
+    children.sort()
+    for potentialTopLevel in children:
+        ext = potentialTopLevel.splitext()[1]
+        if ext in PYTHON_EXTENSIONS:
+            candidates.append((potentialTopLevel.basename()[:-len(ext)],
+                               potentialTopLevel, False))
+        elif not ext and potentialTopLevel.isdir():
+            for ext in PYTHON_EXTENSIONS:
+                initpy = potentialTopLevel.child("__init__"+ext)
+                if initpy.exists():
+                    candidates.append(
+                        (potentialTopLevel.basename(), initpy, True))
+                    break
+    return candidates
+
+
+def _directoryStamp(path):
+    """
+    Get the modification time of a directory, which changes whenever entries
+    are added to or removed from it, or of a zip archive, or C{None} if it
+    doesn't exist.
+    """
+    try:
+        return stat(path).st_mtime
+    except OSError:
+        return None
+
+
 class NotLoadedError(Exception):
     """
     Attempt to access a value that hasn't been loaded yet.
@@ -139,57 +276,69 @@ class _ModuleIteratorHelper:
         @return: a generator which yields PythonModule instances that describe
         modules which can be, or have been, imported.
         """
-        yielded = {}
         if not self.filePath.exists():
             return
+        for pm in self._iterModulesIn(self._packagePaths()):
+            yield pm
+
 
-        for placeToLook in self._packagePaths():
+    def _iterModulesIn(self, placesToLook):
+        """
+        Loop over the modules in the given places, as L{iterModules} does for
+        the places returned by L{_packagePaths}.  Unlike the latter, this
+        doesn't depend on which modules are loaded.
+        """
+        yielded = {}
+        for placeToLook in placesToLook:
             try:
-                children = placeToLook.children()
+                candidates = _moduleCandidates(placeToLook)
             except UnlistableError:
                 continue
 
-            children.sort()
-            for potentialTopLevel in children:
-                ext = potentialTopLevel.splitext()[1]
-                potentialBasename = potentialTopLevel.basename()[:-len(ext)]
-                if ext in PYTHON_EXTENSIONS:
+            for name, filePath, isPackage in candidates:
+                if isPackage:
+                    modname = self._subModuleName(name)
+                else:
                     # TODO: this should be a little choosier about which path entry
                     # it selects first, and it should do all the .so checking and
                     # crud
-                    if not _isPythonIdentifier(potentialBasename):
+                    if not _isPythonIdentifier(name):
                         continue
-                    modname = self._subModuleName(potentialBasename)
+                    modname = self._subModuleName(name)
                     if modname.split(".")[-1] == '__init__':
                         # This marks the directory as a package so it can't be
                         # a module.
                         continue
-                    if modname not in yielded:
-                        yielded[modname] = True
-                        pm = PythonModule(modname, potentialTopLevel, self._getEntry())
-                        assert pm != self
-                        yield pm
-                else:
-                    if (ext or not _isPythonIdentifier(potentialBasename)
-                        or not potentialTopLevel.isdir()):
+                    if modname in yielded:
                         continue
-                    modname = self._subModuleName(potentialTopLevel.basename())
-                    for ext in PYTHON_EXTENSIONS:
-                        initpy = potentialTopLevel.child("__init__"+ext)
-                        if initpy.exists():
-                            yielded[modname] = True
-                            pm = PythonModule(modname, initpy, self._getEntry())
-                            assert pm != self
-                            yield pm
-                            break
-
-    def walkModules(self, importPackages=False):
+                yielded[modname] = True
+                pm = PythonModule(modname, filePath, self._getEntry())
+                assert pm != self
+                yield pm
+
+    def walkModules(self, importPackages=False, threads=None, ordered=True):
         """
         Similar to L{iterModules}, this yields self, and then every module in my
         package or entry, and every submodule in each package or entry.
 
         In other words, this is deep, and L{iterModules} is shallow.
+
+        @param importPackages: Import packages as they are seen.
+
+        @param threads: The number of threads to list packages with, or None
+        to list them one at a time, as they are reached.
+
+        @param ordered: If false, modules listed by threads are yielded in
+        the order they're found rather than in the usual order, which saves
+        waiting for the listings of packages earlier in that order.
         """
+        if threads is not None:
+            return _walkInParallel(self, True, importPackages, threads,
+                                   ordered)
+        return self._walkModules(importPackages)
+
+
+    def _walkModules(self, importPackages):
         yield self
         for package in self.iterModules():
             for module in package.walkModules(importPackages=importPackages):
@@ -273,12 +422,19 @@ class _ImportExportFinder(_iefBase):
     @ivar definedNames: A set of names created by assignment,
                         class definitions, or function definitions
                         at the top level of this module.
+
+    @ivar requiredImports: A list of (source, name) pairs, like
+                           C{imports}, for the absolute import
+                           statements that appear directly at the top
+                           level of this module, in order. These run
+                           whenever the module is loaded.
     """
 
     def __init__(self):
         self.imports = set()
         self.exports = None
         self.definedNames = set()
+        self.requiredImports = []
 
 
     def visit_Import(self, node):
@@ -336,11 +492,122 @@ class _ImportExportFinder(_iefBase):
                     raise SyntaxError("__all__ must only contain literal Python identifier strings")
         for stmt in node.body:
             self.visit(stmt)
+            if isinstance(stmt, ast.Import):
+                for alias in stmt.names:
+                    self.requiredImports.append((None, alias.name))
+            elif isinstance(stmt, ast.ImportFrom) and not stmt.level:
+                for alias in stmt.names:
+                    self.requiredImports.append((stmt.module, alias.name))
             if isinstance(stmt, ast.Assign):
                 collectNames(stmt.targets[0], stmt.value)
             elif isinstance(stmt, (ast.FunctionDef, ast.ClassDef)):
                 self.definedNames.add(stmt.name)
 
+
+    def summary(self):
+        """
+        Describe what I found in marshallable form, for caching.
+
+        @return: a tuple of tuples, understood by L{fromSummary}.
+        """
+        exports = self.exports
+        if exports is not None:
+            exports = tuple(sorted(exports))
+        return (tuple(sorted(self.imports)), tuple(self.requiredImports),
+                exports, tuple(sorted(self.definedNames)))
+
+
+    def fromSummary(cls, summary):
+        """
+        Make a finder which has already found what L{summary} describes.
+        """
+        imports, requiredImports, exports, definedNames = summary
+        finder = cls()
+        finder.imports = set(imports)
+        finder.requiredImports = list(requiredImports)
+        if exports is not None:
+            finder.exports = set(exports)
+        finder.definedNames = set(definedNames)
+        return finder
+    fromSummary = classmethod(fromSummary)
+
+
+
+# The analysis of modules' source, keyed by path, with the stamp of the file
+# it was done for.
+_analysisCache = {}
+
+# The directory analysis is kept in between processes, or None.
+analysisCacheDirectory = None
+
+# Bumped whenever the analysis or its summary changes.
+_ANALYSIS_VERSION = 1
+
+def setAnalysisCacheDirectory(directory):
+    """
+    Keep the static analysis of modules' source in a directory, so that it
+    is only done once for each version of a module, across processes.
+    Entries are named by a hash of the source they describe.
+
+    @param directory: the path of the directory, which is created if
+    necessary, or None to stop.
+    """
+    global analysisCacheDirectory
+    if directory is not None:
+        fp = FilePath(directory)
+        if not fp.isdir():
+            fp.makedirs()
+    analysisCacheDirectory = directory
+
+
+
+def _analysisStamp(filePath):
+    """
+    Return a value which changes whenever a module's source does, or None if
+    there isn't a good one.
+    """
+    try:
+        stamp = (filePath.getModificationTime(),)
+        getsize = getattr(filePath, 'getsize', None)
+        if getsize is not None:
+            stamp += (getsize(),)
+    except (OSError, IOError, KeyError):
+        return None
+    return stamp
+
+
+
+def _analyze(source):
+    """
+    Statically analyze a module's source, using the analysis cache directory
+    if there is one.
+
+    @raise ValueError: if C{source} isn't Python source.
+
+    @return: an L{_ImportExportFinder} which has visited the source.
+    """
+    directory = analysisCacheDirectory
+    if directory is not None:
+        entry = FilePath(directory).child("%s-%d" % (
+            sha1(source).hexdigest(), _ANALYSIS_VERSION))
+        try:
+            return _ImportExportFinder.fromSummary(
+                marshal.loads(entry.getContent()))
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            pass
+    try:
+        tree = ast.parse(source)
+    except TypeError:
+        raise ValueError("Static analysis of module attributes can only be done on Python source.")
+    finder = _ImportExportFinder()
+    finder.visit(tree)
+    if directory is not None:
+        try:
+            entry.setContent(marshal.dumps(finder.summary()))
+        except (IOError, OSError):
+            pass
+    return finder
+
 class PythonAttribute:
     """
     I represent a function, class, or other object that is present.
@@ -465,12 +732,20 @@ class PythonModule(_ModuleIteratorHelper):
         Scan a module for imports, exports, and attributes.
         """
         if self._finder is None:
-            try:
-                tree = ast.parse(self.filePath.getContent())
-            except TypeError:
-                raise ValueError("Static analysis of module attributes can only be done on Python source.")
-            self._finder = _ImportExportFinder()
-            self._finder.visit(tree)
+            getAnalysis = getattr(self.filePath, 'getAnalysis', None)
+            if getAnalysis is not None:
+                # Analyzed ahead of time, e.g. when writing a bundle.
+                self._finder = getAnalysis()
+                return
+            path = self.filePath.path
+            stamp = _analysisStamp(self.filePath)
+            cached = _analysisCache.get(path)
+            if stamp is not None and cached is not None and cached[0] == stamp:
+                self._finder = cached[1]
+                return
+            self._finder = _analyze(self.filePath.getContent())
+            if stamp is not None:
+                _analysisCache[path] = stamp, self._finder
 
 
     def iterAttributes(self):
@@ -530,6 +805,27 @@ class PythonModule(_ModuleIteratorHelper):
                 yield name
 
 
+    def iterRequiredImports(self):
+        """
+        List the absolute imports this module unconditionally performs at its
+        top level, i.e. those not nested in a function, class, conditional or
+        C{try} block.
+
+        @raise NotImplementedError: if AST inspection is not possible.
+
+        @return: a generator yielding C{(source, name)} pairs, in the order
+                 they are imported. C{source} is the name of the module a
+                 name is imported from, or None for plain C{import}
+                 statements.
+        """
+        if ast is None:
+            raise NotImplementedError("Static analysis of module attributes"
+                                      " requires the 'ast' module, found in"
+                                      " Python 2.6 or later.")
+        self._maybeLoadFinder()
+        return iter(self._finder.requiredImports)
+
+
     def iterExportNames(self):
         """
         List all the names exported by this module. If the module
@@ -600,10 +896,11 @@ class PythonModule(_ModuleIteratorHelper):
             return True
         return other.name != self.name
 
-    def walkModules(self, importPackages=False):
-        if importPackages and self.isPackage():
+    def walkModules(self, importPackages=False, threads=None, ordered=True):
+        if importPackages and self.isPackage() and threads is None:
             self.load()
-        return super(PythonModule, self).walkModules(importPackages=importPackages)
+        return super(PythonModule, self).walkModules(
+            importPackages=importPackages, threads=threads, ordered=ordered)
 
     def _subModuleName(self, mn):
         """
@@ -681,6 +978,29 @@ class _DefaultMapImpl:
         return FilePath(fsPathString)
 _theDefaultMapper = _DefaultMapImpl()
 
+# ZipArchives for the archives on the path, keyed by the archive's path, with
+# the archive's modification time and size when it was read.
+_zipArchives = {}
+
+def _getZipArchive(archivePath):
+    """
+    Get a L{ZipArchive} for a zip file, reusing the one made last time
+    unless the file has been modified since.
+
+    @param archivePath: the path of the zip file.
+    """
+    try:
+        st = stat(archivePath)
+    except OSError:
+        return ZipArchive(archivePath)
+    stamp = st.st_mtime, st.st_size
+    cached = _zipArchives.get(archivePath)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    za = ZipArchive(archivePath)
+    _zipArchives[archivePath] = stamp, za
+    return za
+
 class _ZipMapImpl:
     """ IPathImportMapper implementation for zipimport.ZipImporter.  """
     implements(IPathImportMapper)
@@ -695,7 +1015,7 @@ class _ZipMapImpl:
 
         @return: a L{zippath.ZipPath} or L{zippath.ZipArchive} instance.
         """
-        za = ZipArchive(self.importer.archive)
+        za = _getZipArchive(self.importer.archive)
         myPath = FilePath(self.importer.archive)
         itsPath = FilePath(fsPathString)
         if myPath == itsPath:
@@ -712,6 +1032,113 @@ class _ZipMapImpl:
 
 registerAdapter(_ZipMapImpl, zipimport.zipimporter, IPathImportMapper)
 
+def _planListing(node):
+    """
+    Work out where to look for the modules one level below a package, path
+    entry or path, for L{_listModules}.
+
+    This depends on which modules are loaded, through C{__path__}, so it must
+    be done by the thread consuming a walk: the other threads might look while
+    L{exocet.load} has swapped out C{sys.modules}.
+
+    @return: a list of pairs of a L{PathEntry} or L{PythonModule} and the
+    list of FilePath-like objects to look in for its modules.
+    """
+    if isinstance(node, PythonPath):
+        return [(entry, [entry.filePath]) for entry in node.iterEntries()]
+    return [(node, list(node._packagePaths()))]
+
+
+
+def _listModules(node, plan, error):
+    """
+    List the modules one level below a package, path entry or path, for
+    L{_walkInParallel}.
+
+    @param plan: the result of L{_planListing} for C{node}.
+
+    @param error: the exception info of the error planning the listing, if
+    any.
+
+    @return: a tuple of C{node}, a list of L{PythonModule}s or None, and the
+    exception info of the error listing it, if any.
+    """
+    if error is not None:
+        return node, None, error
+    try:
+        modules = []
+        for helper, placesToLook in plan:
+            if helper.filePath.exists():
+                modules.extend(helper._iterModulesIn(placesToLook))
+        return node, modules, None
+    except:
+        return node, None, sys.exc_info()
+
+
+
+def _walkInParallel(root, includeRoot, importPackages, threads, ordered):
+    """
+    Walk the modules below C{root}, listing packages in a pool of threads.
+
+    Packages are imported, if at all, by the thread consuming the walk, before
+    they are listed, and that thread also works out where each package's
+    modules are to be found.  When C{ordered} is true, the packages in each
+    listing are listed as soon as it is reached, so that the walk can descend
+    into the first while the rest are being listed; otherwise every package is
+    listed as soon as it's found, and its modules yielded once they're
+    listed.
+    """
+    pool = ThreadPool(threads)
+    try:
+        def submit(node, callback=None):
+            plan = error = None
+            try:
+                if (importPackages and isinstance(node, PythonModule)
+                    and node.isPackage()):
+                    node.load()
+                plan = _planListing(node)
+            except:
+                error = sys.exc_info()
+            return pool.apply_async(_listModules, (node, plan, error),
+                                    callback=callback)
+
+        def check((node, modules, error)):
+            if error is not None:
+                raise error[0], error[1], error[2]
+            return modules
+
+        if includeRoot:
+            yield root
+        if ordered:
+            def expand(listing):
+                return iter([(m, m.isPackage() and submit(m) or None)
+                             for m in check(listing.get())])
+            stack = [expand(submit(root))]
+            while stack:
+                for module, listing in stack[-1]:
+                    yield module
+                    if listing is not None:
+                        stack.append(expand(listing))
+                        break
+                else:
+                    stack.pop()
+        else:
+            listings = Queue()
+            submit(root, listings.put)
+            pending = 1
+            while pending:
+                modules = check(listings.get())
+                pending -= 1
+                for module in modules:
+                    if module.isPackage():
+                        submit(module, listings.put)
+                        pending += 1
+                    yield module
+    finally:
+        pool.terminate()
+
+
+
 def _defaultSysPathFactory():
     """
     Provide the default behavior of PythonPath's sys.path factory, which is to
@@ -737,6 +1164,10 @@ class PythonPath:
 
     @ivar moduleLoader: a function that takes a fully-qualified python name and
     returns a module, like twisted.python.reflect.namedAny.
+
+    @ivar _moduleIndex: a dictionary mapping the names of modules found by
+    searching the path to C{(sysPath, stamps, packages, module)} tuples.  See
+    L{_indexModule}.
     """
 
     def __init__(self,
@@ -794,6 +1225,7 @@ class PythonPath:
         self.sysPathHooks = sysPathHooks
         self.importerCache = importerCache
         self.moduleLoader = moduleLoader
+        self._moduleIndex = {}
 
 
     def _getSysPath(self):
@@ -896,20 +1328,99 @@ class PythonPath:
             mp = self._smartPath(path)
             return PythonModule(modname, mp, pe)
 
+        # See if we've already searched for it, and nothing has changed since.
+        module = self._lookupIndex(modname)
+        if module is not None:
+            return module
+
         # Recurse if we're trying to get a submodule.
         if '.' in modname:
             pkg = self
             for name in modname.split('.'):
                 pkg = pkg[name]
+            self._indexModule(pkg)
             return pkg
 
         # Finally do the slowest possible thing and iterate
         for module in self.iterModules():
             if module.name == modname:
+                self._indexModule(module)
                 return module
         raise KeyError(modname)
 
 
+    def _indexModule(self, module):
+        """
+        Remember where a module was found, along with the modification times
+        of every directory whose contents could change where it would be
+        found: the path entries searched before it, the directories of each
+        package containing it, and the directories in each of those named
+        like the package or module looked for in it.  The latter catch a
+        directory which isn't a package becoming one.
+
+        Zip archives are stamped with the modification time of the archive.
+        Modules found through other importers aren't remembered.
+
+        @param module: a L{PythonModule} just found by searching the path.
+        """
+        sysPath = tuple(self.sysPath)
+        parts = module.name.split('.')
+        # Pairs of a directory searched and the name searched for in it.
+        directories = []
+        entryPath = module.pathEntry.filePath.path
+        for pathName in sysPath:
+            fp = self._smartPath(pathName)
+            directories.append((fp, parts[0]))
+            if fp.path == entryPath:
+                break
+        else:
+            return
+        packages = []
+        for i in range(1, len(parts)):
+            package = self['.'.join(parts[:i])]
+            paths = list(package._packagePaths())
+            packages.append((package, [p.path for p in paths]))
+            directories.extend((path, parts[i]) for path in paths)
+
+        stamps = []
+        for directory, name in directories:
+            if isinstance(directory, FilePath):
+                path = directory.path
+                candidate = joinpath(path, name)
+                stamps.append((candidate, _directoryStamp(candidate)))
+            elif isinstance(directory, ZipPath):
+                path = directory.archive.zipfile.filename
+            else:
+                return
+            stamps.append((path, _directoryStamp(path)))
+        self._moduleIndex[module.name] = (sysPath, stamps, packages,
+                                          (module.filePath, module.pathEntry))
+
+
+    def _lookupIndex(self, modname):
+        """
+        Find a module remembered by L{_indexModule}, if nothing has changed
+        since which could affect where it would be found.
+
+        @param modname: a fully-qualified module name.
+
+        @return: a new L{PythonModule}, or C{None}.
+        """
+        indexed = self._moduleIndex.get(modname)
+        if indexed is None:
+            return None
+        sysPath, stamps, packages, (filePath, pathEntry) = indexed
+        fresh = (sysPath == tuple(self.sysPath)
+                 and all(_directoryStamp(path) == stamp
+                         for (path, stamp) in stamps)
+                 and all([p.path for p in package._packagePaths()] == paths
+                         for (package, paths) in packages))
+        if not fresh:
+            del self._moduleIndex[modname]
+            return None
+        return PythonModule(modname, filePath, pathEntry)
+
+
     def __repr__(self):
         """
         Display my sysPath and moduleDict in a string representation.
@@ -924,24 +1435,39 @@ class PythonPath:
             for module in entry.iterModules():
                 yield module
 
-    def walkModules(self, importPackages=False):
+    def walkModules(self, importPackages=False, threads=None, ordered=True):
         """
         Similar to L{iterModules}, this yields every module on the path, then every
         submodule in each package or entry.
+
+        @param threads: See L{PythonModule.walkModules}.
+
+        @param ordered: See L{PythonModule.walkModules}.
         """
+        if threads is not None:
+            return _walkInParallel(self, False, False, threads, ordered)
+        return self._walkModules()
+
+
+    def _walkModules(self):
         for package in self.iterModules():
             for module in package.walkModules(importPackages=False):
                 yield module
 
 theSystemPath = PythonPath()
 
-def walkModules(importPackages=False):
+def walkModules(importPackages=False, threads=None, ordered=True):
     """
     Deeply iterate all modules on the global python path.
 
     @param importPackages: Import packages as they are seen.
+
+    @param threads: See L{PythonModule.walkModules}.
+
+    @param ordered: See L{PythonModule.walkModules}.
     """
-    return theSystemPath.walkModules(importPackages=importPackages)
+    return theSystemPath.walkModules(importPackages=importPackages,
+                                     threads=threads, ordered=ordered)
 
 def iterModules():
     """
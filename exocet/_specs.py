@@ -0,0 +1,266 @@
+# -*- test-case-name: exocet.test.test_exocet -*-
+# Copyright (c) 2010-2011 Allen Short. See LICENSE file for details.
+
+"""
+An isolation engine built on module specs and loaders, rather than on
+swapping out the interpreter's global import state.
+
+Each module loaded by this engine gets its own C{__builtins__}, whose
+C{__import__} resolves names through a mapper. Since functions look up
+C{__import__} in their module's builtins, imports made at any time, not
+just while the module is being loaded, go through the same mapper, and
+nothing in C{sys} is touched.
+
+On Python 2, code running with builtins other than the interpreter's own
+runs in restricted execution mode, which (among other things) forbids
+opening files; modules that need that should be loaded with
+L{exocet.load} instead.
+"""
+
+from types import ModuleType
+
+try:
+    import __builtin__ as builtins
+except ImportError:
+    import builtins
+
+try:
+    from importlib.util import spec_from_loader, module_from_spec
+except ImportError:
+    spec_from_loader = module_from_spec = None
+
+from exocet._exocet import (lookupWithMapper, cachedProxyModule,
+                            _resolveImports, _compileModule, _importHooks,
+                            _emit, LOOKUP, HIT, MISS, LOAD_START, LOAD_END)
+from exocet._modules import getModule
+
+
+
+class _MapperImport(object):
+    """
+    A replacement for C{__import__} that resolves every name through a
+    mapper, for the modules loaded by one call to L{specLoad}.
+
+    Where the imported names aren't already attributes of the modules the
+    mapper provides, as happens for submodules it overrides, a proxy with
+    the right attributes is returned instead of modifying the (possibly
+    global) package.
+
+    @ivar mapper: A L{Mapper}.
+
+    @ivar cache: A L{ModuleCache} consulted for modules already loaded with
+                 C{mapper}, or C{None}.
+
+    @ivar _modules: A dict mapping fully-qualified names to the modules
+                    they've been resolved to.
+
+    @ivar _results: A dict mapping the arguments of previous imports to
+                    their results.
+    """
+
+    def __init__(self, mapper, cache=None):
+        self.mapper = mapper
+        self.cache = cache
+        self._modules = {}
+        self._results = {}
+
+
+    def _lookup(self, fqn):
+        """
+        Find a module among those already resolved, in our cache, or else in
+        our mapper.
+        """
+        try:
+            return self._modules[fqn]
+        except KeyError:
+            pass
+        if _importHooks:
+            _emit(LOOKUP, fqn, self.mapper)
+        p = None
+        if self.cache is not None:
+            p = self.cache.getNamed(fqn, self.mapper)
+        if p is None:
+            try:
+                p = lookupWithMapper(self.mapper, fqn)
+            except ImportError:
+                if _importHooks:
+                    _emit(MISS, fqn, self.mapper)
+                raise
+        if _importHooks:
+            _emit(HIT, fqn, self.mapper, p)
+        self._modules[fqn] = p
+        return p
+
+
+    def __call__(self, name, globals=None, locals=None, fromlist=None,
+                 level=-1):
+        """
+        Import a module, as C{__import__} does.
+        """
+        if level > 0:
+            name = _absoluteName(name, globals, level)
+        key = (name, tuple(fromlist or ()))
+        try:
+            return self._results[key]
+        except KeyError:
+            pass
+
+        parts = name.split('.')
+        modules = [self._lookup('.'.join(parts[:i + 1]))
+                   for i in range(len(parts))]
+        m = modules[-1]
+        if fromlist:
+            missing = {}
+            for attr in fromlist:
+                if attr != '*' and not hasattr(m, attr):
+                    try:
+                        missing[attr] = self._lookup(name + '.' + attr)
+                    except ImportError:
+                        pass
+            if missing:
+                m = cachedProxyModule(m, **missing)
+        else:
+            for i in range(len(parts) - 1, 0, -1):
+                parent = modules[i - 1]
+                if getattr(parent, parts[i], None) is not m:
+                    parent = cachedProxyModule(parent, **{parts[i]: m})
+                m = parent
+        self._results[key] = m
+        return m
+
+
+
+def _absoluteName(name, globals, level):
+    """
+    Resolve the name of a relative import.
+
+    @param name: The name being imported, without its leading dots.
+    @param globals: The namespace of the module doing the import.
+    @param level: The number of leading dots.
+    """
+    package = (globals or {}).get('__package__')
+    if not package:
+        raise ImportError("Attempted relative import in non-package")
+    parts = package.split('.')
+    if level - 1 >= len(parts):
+        raise ImportError("Attempted relative import beyond toplevel package")
+    base = '.'.join(parts[:len(parts) - (level - 1)])
+    if name:
+        return base + '.' + name
+    return base
+
+
+
+class _IsolatedLoader(object):
+    """
+    A loader, following the C{create_module}/C{exec_module} protocol of
+    module specs, which runs a module's code with a C{__builtins__} of its
+    own.
+
+    @ivar maker: A module maker object (i.e., a L{modules.PythonModule}
+                 instance).
+
+    @ivar importer: The L{_MapperImport} the module's imports go through.
+    """
+
+    def __init__(self, maker, importer):
+        self.maker = maker
+        self.importer = importer
+        self._builtins = dict(vars(builtins))
+        self._builtins['__import__'] = importer
+
+
+    def create_module(self, spec):
+        """
+        Create an empty module to run the code in.
+        """
+        return ModuleType(self.maker.name)
+
+
+    def exec_module(self, module):
+        """
+        Run the module's code in the module's namespace.
+        """
+        maker = self.maker
+        code = _compileModule(maker.filePath)
+        namespace = module.__dict__
+        namespace['__builtins__'] = self._builtins
+        namespace['__file__'] = maker.filePath.path
+        if maker.isPackage():
+            namespace['__package__'] = maker.name
+        else:
+            namespace['__package__'] = maker.name.rpartition('.')[0]
+        exec(code, namespace)
+
+
+
+def specLoad(maker, mapper, m=None, resolveImports=False, cache=None):
+    """
+    Load a Python module in isolation, like L{exocet.load}, by giving it
+    builtins whose C{__import__} resolves names through C{mapper}, rather than
+    by displacing the interpreter's import state. If a package name is given,
+    its __init__.py is loaded.
+
+    @param maker: A module maker object (i.e., a L{modules.PythonModule}
+    instance)
+
+    @param mapper: A L{Mapper}.
+
+    @param m: An optional empty module object to load code into.
+
+    @param resolveImports: See L{exocet.load}.
+
+    @param cache: See L{exocet.load}.
+
+    @returns: An instance of the module name requested.
+    """
+    if cache is not None and m is None:
+        cached = cache.get(maker, mapper)
+        if cached is not None:
+            return cached
+    if maker.filePath.splitext()[1] in [".so", ".pyd"]:
+        return maker.load()
+    importer = _MapperImport(mapper, cache)
+    loader = _IsolatedLoader(maker, importer)
+    if m is None:
+        if module_from_spec is not None:
+            m = module_from_spec(spec_from_loader(
+                    maker.name, loader, origin=maker.filePath.path))
+        else:
+            m = loader.create_module(None)
+    if _importHooks:
+        _emit(LOAD_START, maker.name, mapper, m)
+    try:
+        if resolveImports:
+            _resolveImports(maker, importer._lookup)
+        loader.exec_module(m)
+    finally:
+        if _importHooks:
+            _emit(LOAD_END, maker.name, mapper, m)
+    if cache is not None:
+        cache.add(maker, mapper, m)
+    return m
+
+
+
+def specLoadNamed(fqn, mapper, m=None, resolveImports=False, cache=None):
+    """
+    Load a Python module in isolation, like L{exocet.loadNamed}, using
+    L{specLoad}.
+
+    @param fqn: The fully qualified name of a Python module, e.g
+    C{twisted.python.filepath}.
+
+    @param mapper: A L{Mapper}.
+
+    @param m: An optional empty module object to load code into.
+
+    @param resolveImports: See L{exocet.load}.
+
+    @param cache: See L{exocet.load}.
+
+    @returns: An instance of the module name requested.
+    """
+    maker = getModule(fqn)
+    return specLoad(maker, mapper, m=m, resolveImports=resolveImports,
+                    cache=cache)
@@ -0,0 +1,261 @@
+# -*- test-case-name: exocet.test.test_exocet -*-
+# Copyright (c) 2010-2011 Allen Short. See LICENSE file for details.
+
+"""
+Instrumented mappers, for finding out where the time spent importing modules
+in isolation goes.
+"""
+
+from timeit import default_timer
+
+from zope.interface import implements
+
+from exocet._exocet import (IMapper, DictMapper, ExclusiveMapper,
+                            _StackedMapper, _FlatMapper, LOAD_START,
+                            LOAD_END)
+
+
+class _LayerStatistics(object):
+    """
+    Counters for one mapper in an instrumented stack.
+
+    @ivar lookups: The number of names looked up in the mapper.
+    @ivar hits: The number of those the mapper resolved.
+    @ivar misses: The number of those the mapper couldn't resolve.
+    @ivar blocked: The number of those the mapper blacklisted itself,
+    without consulting the mappers it wraps.
+    @ivar time: The total time, in seconds, spent in the mapper's lookups.
+    """
+
+    def __init__(self):
+        self.lookups = 0
+        self.hits = 0
+        self.misses = 0
+        self.blocked = 0
+        self.time = 0.0
+
+
+    def hitRatio(self):
+        """
+        Return the fraction of lookups that were hits, or C{None} if there
+        haven't been any.
+        """
+        if not self.lookups:
+            return None
+        return float(self.hits) / self.lookups
+
+
+
+class _InstrumentedMapper(object):
+    """
+    A mapper that counts and times the lookups made in another mapper.
+
+    @ivar _mapper: The mapper being instrumented.
+    @ivar _layer: The L{_LayerStatistics} to record lookups in.
+    @ivar _statistics: The L{MapperStatistics} this mapper reports to, if it
+    is the top of an instrumented stack; otherwise C{None}.
+    """
+
+    implements(IMapper)
+
+    def __init__(self, mapper, layer, statistics=None):
+        self._mapper = mapper
+        self._layer = layer
+        self._statistics = statistics
+
+
+    def lookup(self, name):
+        """
+        @see L{IMapper.lookup}
+        """
+        layer = self._layer
+        layer.lookups += 1
+        if _isBlocked(self._mapper, name):
+            layer.blocked += 1
+        start = default_timer()
+        try:
+            m = self._mapper.lookup(name)
+        except ImportError:
+            layer.misses += 1
+            raise
+        else:
+            layer.hits += 1
+            return m
+        finally:
+            elapsed = default_timer() - start
+            layer.time += elapsed
+            if self._statistics is not None:
+                self._statistics._recordLookup(name, elapsed)
+
+
+    def contains(self, name):
+        """
+        @see L{IMapper.contains}
+        """
+        try:
+            self.lookup(name)
+            return True
+        except ImportError:
+            return False
+
+
+    def withOverrides(self, overrides):
+        """
+        @see L{IMapper.withOverrides}
+        """
+        return _StackedMapper([DictMapper(overrides), self])
+
+
+    def __repr__(self):
+        return "<Instrumented %r>" % (self._mapper,)
+
+
+
+def _describe(mapper):
+    """
+    Describe a mapper briefly, for reports.
+    """
+    description = mapper.__class__.__name__
+    if isinstance(mapper, DictMapper):
+        description += " (%d names)" % (len(mapper._dict),)
+    elif isinstance(mapper, _FlatMapper):
+        description += " (%d names)" % (len(mapper._table),)
+    return description
+
+
+
+def _isBlocked(mapper, name):
+    """
+    Determine whether a mapper refuses a name by blacklisting it itself.
+    """
+    if isinstance(mapper, ExclusiveMapper):
+        return name in mapper._excluded
+    if isinstance(mapper, _FlatMapper):
+        return (name not in mapper._table and mapper._fallback is not None
+                and name in mapper._excluded)
+    return False
+
+
+
+class MapperStatistics(object):
+    """
+    Statistics about the lookups made in instrumented mappers, and the
+    modules that caused them.
+
+    Use L{instrument} to get a mapper that records its lookups here, and
+    register this object with L{exocet.addImportHook} so that the time spent
+    resolving imports is attributed to the modules being loaded.
+
+    @ivar layers: A list of C{(description, L{_LayerStatistics})} pairs, one
+    for each mapper in the instrumented stacks, outermost first.
+
+    @ivar names: A dict mapping fully-qualified names to the total time, in
+    seconds, spent resolving them.
+
+    @ivar modules: A dict mapping the names of loaded modules to dicts
+    mapping the names they imported to the total time spent resolving them.
+    Imports made outside of any module load are attributed to C{None}.
+    """
+
+    def __init__(self):
+        self.layers = []
+        self.names = {}
+        self.modules = {}
+        self._loading = []
+        self._instrumented = {}
+
+
+    def instrument(self, mapper):
+        """
+        Instrument a mapper and all of the mappers it wraps.
+
+        Instrumenting the same mapper again returns the same instrumented
+        mapper, so that caches keyed on mapper identity keep working.
+
+        @param mapper: An L{IMapper} provider.
+
+        @returns: An L{IMapper} provider that resolves names like C{mapper}
+        and records its lookups in this object.
+        """
+        instrumented = self._instrumented.get(id(mapper))
+        if instrumented is None or instrumented[0] is not mapper:
+            instrumented = (mapper, self._instrument(mapper, "", self))
+            self._instrumented[id(mapper)] = instrumented
+        return instrumented[1]
+
+
+    def _instrument(self, mapper, indent, statistics=None):
+        layer = _LayerStatistics()
+        self.layers.append((indent + _describe(mapper), layer))
+        indent += "  "
+        if isinstance(mapper, _StackedMapper):
+            mapper = _StackedMapper([self._instrument(m, indent)
+                                     for m in mapper._submappers])
+        elif isinstance(mapper, ExclusiveMapper):
+            mapper = ExclusiveMapper(
+                self._instrument(mapper._submapper, indent),
+                mapper._excluded)
+        elif isinstance(mapper, _FlatMapper):
+            fallback = mapper._fallback
+            if fallback is not None:
+                fallback = self._instrument(fallback, indent)
+            mapper = _FlatMapper(
+                mapper._table, mapper._excluded, fallback,
+                [(excluded, self._instrument(m, indent))
+                 for (excluded, m) in mapper._rest])
+        return _InstrumentedMapper(mapper, layer, statistics)
+
+
+    def _recordLookup(self, name, elapsed):
+        self.names[name] = self.names.get(name, 0.0) + elapsed
+        if self._loading:
+            loading = self._loading[-1]
+        else:
+            loading = None
+        imports = self.modules.setdefault(loading, {})
+        imports[name] = imports.get(name, 0.0) + elapsed
+
+
+    def __call__(self, event):
+        """
+        Keep track of the modules being loaded, as an import hook.
+
+        @param event: An L{exocet.ImportEvent}.
+        """
+        if event.kind == LOAD_START:
+            self._loading.append(event.name)
+        elif event.kind == LOAD_END:
+            self._loading.pop()
+
+
+    def report(self, limit=10):
+        """
+        Describe the statistics gathered so far.
+
+        @param limit: The number of most expensive modules and names to list.
+
+        @returns: A multi-line string.
+        """
+        lines = ["%8s %8s %8s %8s %10s  %s" % (
+                "lookups", "hits", "misses", "blocked", "time", "mapper")]
+        for description, layer in self.layers:
+            lines.append("%8d %8d %8d %8d %10.6f  %s" % (
+                    layer.lookups, layer.hits, layer.misses, layer.blocked,
+                    layer.time, description))
+
+        lines.append("")
+        lines.append("Most expensive modules:")
+        totals = [(sum(imports.values()), name)
+                  for (name, imports) in self.modules.iteritems()]
+        for total, name in sorted(totals, reverse=True)[:limit]:
+            imports = self.modules[name]
+            worst = max(imports, key=imports.get)
+            lines.append("%10.6f  %s (slowest: %s, %.6f)" % (
+                    total, name, worst, imports[worst]))
+
+        lines.append("")
+        lines.append("Most expensive names:")
+        for name in sorted(self.names, key=self.names.get,
+                           reverse=True)[:limit]:
+            lines.append("%10.6f  %s" % (self.names[name], name))
+        return "\n".join(lines)
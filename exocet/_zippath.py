@@ -16,6 +16,9 @@ import os
 import time
 import errno
 import zipfile
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
 
 from exocet._filepath import FilePath, _PathHelper
 
@@ -24,6 +27,7 @@ from exocet._filepath import FilePath, _PathHelper
 
 ZIP_PATH_SEP = '/'              # In zipfiles, "/" is universally used as the
                                 # path separator, regardless of platform.
+_AFTER_SEP = chr(ord(ZIP_PATH_SEP) + 1)
 
 
 class ZipPath(_PathHelper):
@@ -72,7 +76,7 @@ class ZipPath(_PathHelper):
         return self.isdir() or self.isfile()
 
     def isdir(self):
-        return self.pathInArchive in self.archive.childmap
+        return self.archive._isDirectory(self.pathInArchive)
 
     def isfile(self):
         return self.pathInArchive in self.archive.zipfile.NameToInfo
@@ -83,7 +87,7 @@ class ZipPath(_PathHelper):
     def listdir(self):
         if self.exists():
             if self.isdir():
-                return self.archive.childmap[self.pathInArchive].keys()
+                return self.archive._listDirectory(self.pathInArchive)
             else:
                 raise OSError(errno.ENOTDIR, "Leaf zip entry listed")
         else:
@@ -111,6 +115,17 @@ class ZipPath(_PathHelper):
     def open(self):
         return self.archive.zipfile.open(self.pathInArchive)
 
+    def getContent(self):
+        """
+        Read the decompressed contents of this member, from the archive's
+        content cache if it has one.
+        """
+        cache = self.archive.contentCache
+        if cache is None:
+            return self.archive._readMember(self.pathInArchive)
+        return cache.get(self.pathInArchive,
+                         lambda: self.archive._readMember(self.pathInArchive))
+
     def restat(self):
         pass
 
@@ -148,9 +163,64 @@ class ZipPath(_PathHelper):
 
 
 
+class ContentCache:
+    """
+    A size-bounded cache of the decompressed contents of the members of an
+    archive, which discards the least recently read members first.
+
+    @ivar maxSize: the number of bytes of content to keep, at most.  Members
+    larger than this are never cached.
+
+    @ivar size: the number of bytes of content currently kept.
+
+    @ivar hits: the number of reads answered from the cache.
+
+    @ivar misses: the number of reads which had to decompress the member.
+    """
+
+    def __init__(self, maxSize):
+        self.maxSize = maxSize
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._contents = OrderedDict()
+        self._lock = threading.Lock()
+
+
+    def get(self, name, read):
+        """
+        Get the contents of a member, reading them if they aren't cached.
+
+        @param name: the member's path in the archive.
+
+        @param read: a 0-argument callable returning the member's contents.
+        """
+        with self._lock:
+            content = self._contents.pop(name, None)
+            if content is not None:
+                self._contents[name] = content
+                self.hits += 1
+                return content
+            self.misses += 1
+        content = read()
+        if len(content) <= self.maxSize:
+            with self._lock:
+                if name not in self._contents:
+                    self._contents[name] = content
+                    self.size += len(content)
+                    while self.size > self.maxSize:
+                        evicted = self._contents.popitem(last=False)[1]
+                        self.size -= len(evicted)
+        return content
+
+
+
 class ZipArchive(ZipPath):
     """ I am a FilePath-like object which can wrap a zip archive as if it were a
     directory.
+
+    @ivar contentCache: a L{ContentCache}, or C{None}.  See
+    L{cacheContents}.
     """
     archive = property(lambda self: self)
     def __init__(self, archivePathname):
@@ -161,19 +231,120 @@ class ZipArchive(ZipPath):
         self.zipfile = zipfile.ZipFile(archivePathname)
         self.path = archivePathname
         self.pathInArchive = ''
-        # zipfile is already wasting O(N) memory on cached ZipInfo instances,
-        # so there's no sense in trying to do this lazily or intelligently
-        self.childmap = {}      # map parent: list of children
+        # The sorted member names, which are all that's needed to find the
+        # directories in the archive; built the first time they're needed.
+        self._names = None
+        self.contentCache = None
+
+
+    def _readMember(self, pathInArchive):
+        """
+        Read and decompress a member of the archive.  Several threads can
+        read members at once: the archive is opened by name, so
+        C{ZipFile.open} reads each member through a file handle of its own,
+        and the central directory is only ever read once.
+
+        @param pathInArchive: the member's name in the archive.
+        """
+        fp = self.zipfile.open(pathInArchive)
+        try:
+            return fp.read()
+        finally:
+            fp.close()
 
-        for name in self.zipfile.namelist():
+
+    def cacheContents(self, maxSize=4 * 1024 * 1024):
+        """
+        Keep the contents of recently read members in memory, so that reading
+        them again doesn't decompress them again.
+
+        @param maxSize: the number of bytes of content to keep, at most.
+
+        @return: the L{ContentCache}, whose statistics can be inspected.
+        """
+        self.contentCache = ContentCache(maxSize)
+        return self.contentCache
+
+
+    def _sortedNames(self):
+        """
+        Get the names of the archive's members, sorted, so that the members
+        below any directory are next to each other.
+        """
+        names = self._names
+        if names is None:
+            names = self._names = sorted(self.zipfile.namelist())
+        return names
+
+
+    def _isDirectory(self, pathInArchive):
+        """
+        Determine whether any member of the archive is below a path.
+
+        @param pathInArchive: a ZIP_PATH_SEP-separated string.
+        """
+        names = self._sortedNames()
+        if not pathInArchive:
+            return bool(names)
+        prefix = pathInArchive + ZIP_PATH_SEP
+        i = bisect_left(names, prefix)
+        return i < len(names) and names[i].startswith(prefix)
+
+
+    def _listDirectory(self, pathInArchive):
+        """
+        List the names directly below a path in the archive, by looking at
+        the run of sorted member names below it and skipping over the members
+        of each subdirectory.
+
+        @param pathInArchive: a ZIP_PATH_SEP-separated string, which must be
+        a directory according to L{_isDirectory}.
+
+        @return: a list of names.
+        """
+        if pathInArchive:
+            prefixes = [pathInArchive + ZIP_PATH_SEP]
+        else:
+            # Members with absolute names are in both '' and '/', but the
+            # first of those is also the name of the root.
+            prefixes = ['', ZIP_PATH_SEP]
+        names = self._sortedNames()
+        children = []
+        seen = set()
+        for prefix in prefixes:
+            i = bisect_left(names, prefix)
+            while i < len(names) and names[i].startswith(prefix):
+                child, sep, rest = names[i][len(prefix):].partition(
+                    ZIP_PATH_SEP)
+                if child not in seen:
+                    seen.add(child)
+                    children.append(child)
+                if sep:
+                    # Everything starting with prefix + child + '/' sorts
+                    # before prefix + child + the character after '/'.
+                    i = bisect_left(names, prefix + child + _AFTER_SEP, i + 1)
+                else:
+                    i += 1
+        return children
+
+
+    @property
+    def childmap(self):
+        """
+        A dict mapping the path of every directory in the archive to a dict
+        whose keys are the names in it.  Built from scratch on every access;
+        use L{ZipPath.isdir} and L{ZipPath.listdir} instead.
+        """
+        childmap = {}
+        for name in self._sortedNames():
             name = name.split(ZIP_PATH_SEP)
             for x in range(len(name)):
                 child = name[-x]
                 parent = ZIP_PATH_SEP.join(name[:-x])
-                if parent not in self.childmap:
-                    self.childmap[parent] = {}
-                self.childmap[parent][child] = 1
-            parent = ''
+                if parent not in childmap:
+                    childmap[parent] = {}
+                childmap[parent][child] = 1
+        return childmap
 
     def child(self, path):
         """
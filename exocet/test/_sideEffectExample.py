@@ -0,0 +1,3 @@
+import sideEffects
+sideEffects.append("executed")
+from missing import name
@@ -1,9 +1,22 @@
 # Copyright (c) 2010-2011 Allen Short. See LICENSE file for details.
+import os
+import py_compile
+import shutil
 import sys
+import tempfile
+import zipfile
+from types import ModuleType
 from unittest import TestCase
-from exocet import (loadNamed, load, emptyMapper, pep302Mapper, getModule,
-                    IMapper, DictMapper, ExclusiveMapper, proxyModule)
+from exocet import (loadNamed, load, loadPackage, emptyMapper, pep302Mapper,
+                    getModule, IMapper, DictMapper, ExclusiveMapper,
+                    proxyModule, CallableMapper, flattenMapper, ModuleCache,
+                    addImportHook, removeImportHook, MapperStatistics,
+                    cachedProxyModule, refreshProxy, specLoad,
+                    specLoadNamed, writeBundle, openBundle, BundleImporter,
+                    BundleMapper, modificationTime)
 from zope.interface.verify import verifyObject
+from exocet._modules import PythonPath
+from exocet._filepath import FilePath
 
 def assertIdentical(self, left, right):
     """
@@ -35,6 +48,26 @@ class ModuleTests(TestCase):
         self.assertEqual(m2.utilName, "hooray")
 
 
+    def test_loadResolvingImports(self):
+        """
+        Modules can be loaded with their top-level imports resolved before
+        any of their code runs, so missing imports fail without side effects.
+        """
+        log = []
+        mapper = DictMapper({"sideEffects": log})
+        self.assertRaises(ImportError, loadNamed,
+                          "exocet.test._sideEffectExample", mapper,
+                          resolveImports=True)
+        self.assertEqual(log, [])
+        self.assertRaises(ImportError, loadNamed,
+                          "exocet.test._sideEffectExample", mapper)
+        self.assertEqual(log, ["executed"])
+
+        m = loadNamed("exocet.test.testpackage.foo", pep302Mapper,
+                      resolveImports=True)
+        self.assertEqual(m.fooName, "hooray")
+
+
     def test_loadd(self):
         """
         Modules can be loaded independent of global state.
@@ -54,6 +87,247 @@ class ModuleTests(TestCase):
         self.assertEqual(m2.utilName, "hooray")
 
 
+    def test_loadFromZip(self):
+        """
+        Modules can be loaded straight out of zip archives.
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        archive = os.path.join(directory, "plugins.zip")
+        zf = zipfile.ZipFile(archive, "w")
+        zf.writestr("zpkg/__init__.py", "")
+        zf.writestr("zpkg/mod.py", "import os\nvalue = 42\n")
+        zf.close()
+        maker = PythonPath(sysPath=[archive], moduleDict={})["zpkg.mod"]
+        m = load(maker, pep302Mapper)
+        self.assertEqual(m.value, 42)
+        import os as realOS
+        assertIdentical(self, m.os, realOS)
+        self.assertEqual(m.__file__, os.path.join(archive, "zpkg", "mod.py"))
+
+
+    def test_loadCompiled(self):
+        """
+        Modules which only exist as bytecode can be loaded.
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        source = os.path.join(directory, "compiledmod.py")
+        with open(source, "w") as f:
+            f.write("value = 'compiled'\n")
+        py_compile.compile(source)
+        os.remove(source)
+        maker = PythonPath(sysPath=[directory], moduleDict={})["compiledmod"]
+        self.assertEqual(load(maker, emptyMapper).value, "compiled")
+
+
+    def test_loadFromBundle(self):
+        """
+        Modules can be found and loaded in a bundle written from a package,
+        and their static analysis is read from the bundle rather than redone.
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        bundle = os.path.join(directory, "plugins.bundle")
+        writeBundle("exocet.test.testpackage", bundle)
+        pythonPath = openBundle(bundle)
+        package = pythonPath["exocet.test.testpackage"]
+        self.assertEqual(sorted(m.name for m in package.iterModules()),
+                         ["exocet.test.testpackage.baz",
+                          "exocet.test.testpackage.foo",
+                          "exocet.test.testpackage.topmodule",
+                          "exocet.test.testpackage.util"])
+        maker = pythonPath["exocet.test.testpackage.foo"]
+        self.assertEqual(list(maker.iterRequiredImports()),
+                         list(getModule("exocet.test.testpackage.foo")
+                              .iterRequiredImports()))
+        m = load(maker, BundleMapper(pythonPath, pep302Mapper))
+        self.assertEqual(m.fooName, "hooray")
+        self.assertEqual(m.__file__, os.path.join(
+                bundle, "exocet", "test", "testpackage", "foo.pyc"))
+        self.assertEqual(m.util.__file__, os.path.join(
+                bundle, "exocet", "test", "testpackage", "util.pyc"))
+
+
+    def test_bundleMapperCache(self):
+        """
+        A L{BundleMapper} given a L{ModuleCache} shares the modules it loads
+        from the bundle with callers loading them through the cache.
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        bundle = os.path.join(directory, "plugins.bundle")
+        writeBundle("exocet.test.testpackage", bundle)
+        pythonPath = openBundle(bundle)
+        cache = ModuleCache()
+        mapper = BundleMapper(pythonPath, pep302Mapper, cache=cache)
+        foo = load(pythonPath["exocet.test.testpackage.foo"], mapper,
+                   cache=cache)
+        util = load(pythonPath["exocet.test.testpackage.util"], mapper,
+                    cache=cache)
+        assertIdentical(self, util, foo.util)
+        baz = pythonPath["exocet.test.testpackage.baz"]
+        assertIdentical(self, mapper.lookup(baz.name),
+                        load(baz, mapper, cache=cache))
+
+
+    def test_bundleUnanalyzable(self):
+        """
+        Modules which can't be statically analyzed can be bundled, and their
+        analysis is only refused when it's used.
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        source = os.path.join(directory, "starpkg")
+        os.mkdir(source)
+        with open(os.path.join(source, "__init__.py"), "w") as f:
+            f.write("")
+        with open(os.path.join(source, "star.py"), "w") as f:
+            f.write("from os.path import *\n")
+        bundle = os.path.join(directory, "plugins.bundle")
+        writeBundle(PythonPath(sysPath=[directory], moduleDict={})
+                    ["starpkg"], bundle)
+        maker = openBundle(bundle)["starpkg.star"]
+        self.assertRaises(SyntaxError, maker.iterRequiredImports)
+        m = load(maker, pep302Mapper, resolveImports=True)
+        self.assertEqual(m.join("a", "b"), os.path.join("a", "b"))
+
+
+    def test_bundleImporter(self):
+        """
+        L{BundleImporter} makes modules in bundles on C{sys.path}
+        importable.
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        source = os.path.join(directory, "bundledpkg")
+        os.mkdir(source)
+        with open(os.path.join(source, "__init__.py"), "w") as f:
+            f.write("")
+        with open(os.path.join(source, "mod.py"), "w") as f:
+            f.write("from bundledpkg import sibling\nvalue = sibling.x\n")
+        with open(os.path.join(source, "sibling.py"), "w") as f:
+            f.write("x = 17\n")
+        bundle = os.path.join(directory, "plugins.bundle")
+        writeBundle(PythonPath(sysPath=[directory], moduleDict={})
+                    ["bundledpkg"], bundle)
+        shutil.rmtree(source)
+
+        self.addCleanup(sys.path_importer_cache.pop, bundle, None)
+        self.addCleanup(sys.path.remove, bundle)
+        self.addCleanup(sys.path_hooks.remove, BundleImporter)
+        sys.path_hooks.append(BundleImporter)
+        sys.path.insert(0, bundle)
+        for name in ["bundledpkg", "bundledpkg.mod", "bundledpkg.sibling"]:
+            self.addCleanup(sys.modules.pop, name, None)
+        import bundledpkg.mod
+        self.assertEqual(bundledpkg.mod.value, 17)
+        maker = getModule("bundledpkg.mod")
+        self.assertEqual(load(maker, pep302Mapper).value, 17)
+
+
+    def test_loadCached(self):
+        """
+        Loading a module through a L{ModuleCache} again with the same mapper
+        returns the module loaded the first time, unless it has changed or
+        has been invalidated.
+        """
+        cache = ModuleCache()
+        maker = getModule("exocet.test.testpackage.util")
+        m1 = load(maker, emptyMapper, cache=cache)
+        assertIdentical(self, load(maker, emptyMapper, cache=cache), m1)
+        assertIdentical(
+            self, loadNamed("exocet.test.testpackage.util", emptyMapper,
+                            cache=cache), m1)
+        self.assertFalse(load(maker, pep302Mapper, cache=cache) is m1)
+        self.assertFalse(load(maker, emptyMapper) is m1)
+
+        cache.invalidate(maker)
+        m2 = load(maker, emptyMapper, cache=cache)
+        self.assertFalse(m2 is m1)
+
+        # Pretend the source changed after it was loaded.
+        key = (maker.filePath.path, id(emptyMapper))
+        cache._modules[key] = cache._modules[key][:2] + (0,) + (m2,)
+        self.assertFalse(load(maker, emptyMapper, cache=cache) is m2)
+
+
+    def test_loadCachedSiblings(self):
+        """
+        Modules loaded through a L{ModuleCache} import cached modules loaded
+        with the same mapper instead of asking the mapper for them.
+        """
+        cache = ModuleCache()
+        util = loadNamed("exocet.test.testpackage.util", pep302Mapper,
+                         cache=cache)
+        util.utilName = "cached"
+        foo = loadNamed("exocet.test.testpackage.foo", pep302Mapper,
+                        cache=cache)
+        self.assertEqual(foo.fooName, "cached")
+        assertIdentical(self, foo.util, util)
+
+        import exocet.test.testpackage
+        self.assertFalse(getattr(exocet.test.testpackage, "util", None)
+                         is util)
+
+
+    def test_loadCachedSiblingsResolvingImports(self):
+        """
+        Resolving a module's imports before running it finds cached modules
+        loaded with the same mapper, rather than loading them again.
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with open(os.path.join(directory, "counthelper.py"), "w") as f:
+            f.write("import sideEffects\n"
+                    "sideEffects.append('helper')\n"
+                    "value = 3\n")
+        with open(os.path.join(directory, "countplugin.py"), "w") as f:
+            f.write("from counthelper import value\n")
+        pythonPath = PythonPath(sysPath=[directory], moduleDict={})
+        for loader in load, specLoad:
+            effects = []
+            mapper = pep302Mapper.withOverrides({"sideEffects": effects})
+            cache = ModuleCache()
+            loader(pythonPath["counthelper"], mapper, resolveImports=True,
+                   cache=cache)
+            plugin = loader(pythonPath["countplugin"], mapper,
+                            resolveImports=True, cache=cache)
+            self.assertEqual(plugin.value, 3)
+            self.assertEqual(effects, ["helper"])
+            self.assertNotIn("counthelper", sys.modules)
+
+
+    def test_loadPackage(self):
+        """
+        L{loadPackage} loads every module of a package once, into a single
+        namespace from which the package's modules import each other.
+        """
+        pkg = loadPackage(getModule("exocet.test.testpackage"), pep302Mapper)
+        import exocet.test.testpackage
+        self.assertFalse(pkg is exocet.test.testpackage)
+        self.assertFalse(pkg in sys.modules.values())
+        self.assertEqual(pkg.topName, "top value")
+        assertIdentical(self, pkg.foo.util, pkg.util)
+        assertIdentical(self, pkg.topmodule.foo, pkg.foo)
+        assertIdentical(self, pkg.baz.util, pkg.util)
+
+
+    def test_loadPackageCircular(self):
+        """
+        Circular imports between the modules of a package loaded by
+        L{loadPackage} are resolved with partially-loaded modules.
+        """
+        import os.path, exocet.test
+        testDir = os.path.dirname(exocet.test.__file__)
+        sys.path.insert(0, testDir)
+        self.addCleanup(sys.path.remove, testDir)
+        pkg = loadPackage(getModule("testpackage_circular"), emptyMapper)
+        assertIdentical(self, pkg.util.foo, pkg.foo)
+        self.assertEqual(pkg.util.get(), 1234)
+        self.assertEqual(pkg.foo.value, 1234)
+
+
 
 class MapperTests(TestCase):
     """
@@ -102,6 +376,43 @@ class MapperTests(TestCase):
             self.assertFalse(em.contains(name))
 
 
+    def test_exclusiveMapperSubtrees(self):
+        """
+        L{ExclusiveMapper} can blacklist packages along with all of their
+        submodules.
+        """
+        em = ExclusiveMapper(pep302Mapper, ["compiler", "exocet.test"],
+                             subtrees=True)
+        for name in ["compiler", "compiler.visitor", "exocet.test",
+                     "exocet.test.testpackage"]:
+            self.assertRaises(ImportError, em.lookup, name)
+            self.assertFalse(em.contains(name))
+        self.assertTrue(em.contains("exocet"))
+        self.assertTrue(em.contains("exocet._exocet"))
+        self.assertTrue(flattenMapper(em).contains("exocet"))
+        self.assertFalse(flattenMapper(em).contains("compiler.visitor"))
+
+
+    def test_dictMapperSubtrees(self):
+        """
+        L{DictMapper} can resolve names below a package from the package's
+        attributes.
+        """
+        class fakeBar:
+            baz = object()
+        class fakeFoo:
+            bar = fakeBar
+        dm = DictMapper({"foo": fakeFoo, "foo.bar.quux": 1}, subtrees=True)
+        assertIdentical(self, dm.lookup("foo"), fakeFoo)
+        assertIdentical(self, dm.lookup("foo.bar"), fakeBar)
+        assertIdentical(self, dm.lookup("foo.bar.baz"), fakeBar.baz)
+        self.assertEqual(dm.lookup("foo.bar.quux"), 1)
+        self.assertRaises(ImportError, dm.lookup, "foo.nope")
+        self.assertRaises(ImportError, dm.lookup, "food")
+        self.assertFalse(dm.contains("foo.nope"))
+        self.assertFalse(DictMapper({"foo": fakeFoo}).contains("foo.bar"))
+
+
     def test_exclusiveMapperOverrides(self):
         """
         L{ExclusiveMapper} can be overriden.
@@ -119,7 +430,6 @@ class MapperTests(TestCase):
         The L{pep302Mapper} looks up modules by invoking __import__.
         """
         import exocet, exocet.test, compiler.visitor
-        pep302Mapper._oldSysModules = sys.modules.copy()
         verifyObject(IMapper, pep302Mapper)
         for (name, mod) in {"sys": sys,
                             "exocet": exocet,
@@ -132,11 +442,56 @@ class MapperTests(TestCase):
                           "exocet._nonexistentModule")
 
 
+    def test_pep302MapperCache(self):
+        """
+        The L{pep302Mapper} remembers the modules it has resolved and returns
+        them without importing them again, until its cache is flushed.
+        """
+        import exocet.test
+        mapper = pep302Mapper.__class__()
+        assertIdentical(self, mapper.lookup("exocet.test"), exocet.test)
+
+        def noImport(*a, **kw):
+            raise ImportError("imported %r" % (a,))
+        _exocet = sys.modules['exocet._exocet']
+        self.addCleanup(setattr, _exocet, '_originalImport',
+                        _exocet._originalImport)
+        _exocet._originalImport = noImport
+        assertIdentical(self, mapper.lookup("exocet.test"), exocet.test)
+
+        mapper.flushCache("exocet")
+        self.assertRaises(ImportError, mapper.lookup, "exocet.test")
+
+
+    def test_pep302MapperCacheBounded(self):
+        """
+        The L{pep302Mapper} cache discards the least recently used names once
+        it holds more than C{cacheSize} of them.
+        """
+        mapper = pep302Mapper.__class__(cacheSize=2)
+        for name in ["sys", "os", "sys", "exocet"]:
+            mapper.lookup(name)
+        self.assertEqual(list(mapper._resolved), ["sys", "exocet"])
+
+
+    def test_isolationReleasesModules(self):
+        """
+        Loading a module doesn't leave the displaced contents of
+        L{sys.modules} referenced once the load is finished, even if the
+        loaded module raised an exception.
+        """
+        from exocet import _exocet
+        loadNamed("exocet.test.testpackage.util", pep302Mapper)
+        self.assertEqual(_exocet._isolatedSysModules, [])
+        self.assertRaises(ImportError, loadNamed,
+                          "exocet.test.testpackage.foo", emptyMapper)
+        self.assertEqual(_exocet._isolatedSysModules, [])
+
+
     def test_overrides(self):
         """
         The L{pep302Mapper} supports overriding its mappings with a dict.
         """
-        pep302Mapper._oldSysModules = sys.modules.copy()
         fakeMath = object()
         m = pep302Mapper.withOverrides({"math": fakeMath})
         self.assertTrue(m.contains("math"))
@@ -145,6 +500,46 @@ class MapperTests(TestCase):
         assertIdentical(self, m.lookup("sys"), sys)
 
 
+    def test_flattenMapper(self):
+        """
+        L{flattenMapper} compiles a stack of overrides and exclusions into a
+        single mapper that resolves names the same way.
+        """
+        import exocet
+        fakeMath, fakeSys, fakeOs = object(), object(), object()
+        stacked = ExclusiveMapper(pep302Mapper, ["sys", "os"]).withOverrides(
+            {"math": object()}).withOverrides(
+            {"sys": fakeSys, "math": fakeMath})
+        flat = flattenMapper(stacked)
+        verifyObject(IMapper, flat)
+
+        assertIdentical(self, flat.lookup("math"), fakeMath)
+        assertIdentical(self, flat.lookup("sys"), fakeSys)
+        assertIdentical(self, flat.lookup("exocet"), exocet)
+        self.assertRaises(ImportError, flat.lookup, "os")
+        self.assertFalse(flat.contains("os"))
+
+        flatter = flat.withOverrides({"os": fakeOs})
+        self.assertEqual(type(flatter), type(flat))
+        assertIdentical(self, flatter.lookup("os"), fakeOs)
+        self.assertRaises(ImportError, flat.lookup, "os")
+
+
+    def test_flattenMapperLaterLayers(self):
+        """
+        Mappers stacked after a blacklisted fallback are still consulted by a
+        flattened mapper.
+        """
+        fakeSys = object()
+        from exocet._exocet import _StackedMapper
+        stacked = _StackedMapper([ExclusiveMapper(pep302Mapper, ["sys"]),
+                                  DictMapper({"sys": fakeSys})])
+        flat = flattenMapper(stacked)
+        assertIdentical(self, flat.lookup("sys"), fakeSys)
+        self.assertRaises(ImportError, flattenMapper(emptyMapper).lookup,
+                          "sys")
+
+
     def test_ospath(self):
         """
         L{pep302Mapper} deals with modules that import L{os.path} properly.
@@ -176,11 +571,235 @@ class MapperTests(TestCase):
         self.assertEqual(util2.utilName, fakeUtil.utilName)
 
 
+    def test_localImportsMemoized(self):
+        """
+        Repeated local imports in a module loaded by Exocet are answered
+        without consulting the mapper again.
+        """
+        class fakeUtil:
+            utilName = "booo"
+
+        class tpli:
+            util = fakeUtil
+        looked = []
+        def lookup(name):
+            looked.append(name)
+            return m.lookup(name)
+        m = pep302Mapper.withOverrides(
+            {"exocet.test.testpackage_localimports": tpli})
+
+        foo = loadNamed("exocet.test.testpackage_localimports.foo",
+                        CallableMapper(lookup))
+        foo.do()
+        self.assertIn("exocet.test.testpackage_localimports", looked)
+        del looked[:]
+        util2 = foo.do()
+        self.assertEqual(looked, [])
+        assertIdentical(self, util2, fakeUtil)
+        self.assertEqual(foo.fooName, [fakeUtil.utilName] * 2)
+
+
+class SpecLoadTests(TestCase):
+    """
+    Tests for loading modules with per-module builtins.
+    """
+
+    def test_specLoad(self):
+        """
+        Modules can be loaded independent of global state, without their
+        imports touching C{sys.modules}.
+        """
+        maker = getModule("exocet.test.testpackage.foo")
+        before = sys.modules.copy()
+        m1 = specLoad(maker, pep302Mapper)
+        m2 = specLoad(maker, pep302Mapper)
+        self.assertFalse(m1 is m2)
+        self.assertFalse(m1 in sys.modules.values())
+        self.assertEqual(m1.fooName, "hooray")
+        self.assertEqual(m1.__name__, "exocet.test.testpackage.foo")
+        self.assertEqual(sys.modules, before)
+        self.assertRaises(ImportError, specLoad, maker, emptyMapper)
+
+
+    def test_specLoadOverrides(self):
+        """
+        Overridden modules are imported in place of the real ones, even
+        when they're submodules of a real package.
+        """
+        fakeUtil = ModuleType("util")
+        fakeUtil.utilName = "booo"
+        package = ModuleType("exocet.test.testpackage")
+        m = pep302Mapper.withOverrides({"exocet.test.testpackage": package,
+                                        "exocet.test.testpackage.util":
+                                            fakeUtil})
+        foo = specLoadNamed("exocet.test.testpackage.foo", m)
+        self.assertEqual(foo.fooName, "booo")
+        assertIdentical(self, foo.util, fakeUtil)
+        self.assertFalse(hasattr(package, "util"))
+
+
+    def test_specLoadLocalImports(self):
+        """
+        Function-level imports in modules loaded with L{specLoad} are
+        resolved through the mapper the module was loaded with.
+        """
+        class fakeUtil:
+            utilName = "booo"
+
+        class tpli:
+            util = fakeUtil
+        m = pep302Mapper.withOverrides(
+            {"exocet.test.testpackage_localimports": tpli})
+
+        foo = specLoadNamed("exocet.test.testpackage_localimports.foo", m)
+        util2 = foo.do()
+        self.assertEqual(foo.fooName, [fakeUtil.utilName])
+        assertIdentical(self, util2, fakeUtil)
+
+
+class ImportHookTests(TestCase):
+    """
+    Tests for structured import event hooks.
+    """
+
+    def test_events(self):
+        """
+        Registered hooks are told about every lookup made by an isolated
+        module, whether it succeeded, and when modules start and finish
+        loading.
+        """
+        events = []
+        def hook(event):
+            events.append((event.kind, event.name, event.mapper,
+                           event.module))
+        addImportHook(hook)
+        self.addCleanup(removeImportHook, hook)
+        mapper = DictMapper({"sideEffects": []})
+
+        self.assertRaises(ImportError, loadNamed,
+                          "exocet.test._sideEffectExample", mapper)
+        name = "exocet.test._sideEffectExample"
+        m = events[0][3]
+        self.assertEqual(events, [
+                ("loadStart", name, mapper, m),
+                ("lookup", "sideEffects", mapper, None),
+                ("hit", "sideEffects", mapper, mapper._dict["sideEffects"]),
+                ("lookup", "missing", mapper, None),
+                ("miss", "missing", mapper, None),
+                ("loadEnd", name, mapper, m)])
+
+        # Imports resolved before the module runs are reported the same way.
+        for loader in loadNamed, specLoadNamed:
+            del events[:]
+            self.assertRaises(ImportError, loader, name, mapper,
+                              resolveImports=True)
+            m = events[0][3]
+            self.assertEqual(events, [
+                    ("loadStart", name, mapper, m),
+                    ("lookup", "sideEffects", mapper, None),
+                    ("hit", "sideEffects", mapper,
+                     mapper._dict["sideEffects"]),
+                    ("lookup", "missing", mapper, None),
+                    ("miss", "missing", mapper, None),
+                    ("loadEnd", name, mapper, m)])
+        self.assertEqual(mapper._dict["sideEffects"], ["executed"])
+
+        removeImportHook(hook)
+        del events[:]
+        loadNamed("exocet.test.testpackage.util", mapper)
+        self.assertEqual(events, [])
+        addImportHook(hook)
+
+
+
+class MapperStatisticsTests(TestCase):
+    """
+    Tests for L{MapperStatistics}.
+    """
+
+    def test_layers(self):
+        """
+        Instrumented mappers count lookups, hits, misses and blacklisted
+        names for each layer of a mapper stack.
+        """
+        stats = MapperStatistics()
+        fake = object()
+        mapper = ExclusiveMapper(pep302Mapper, ["os"]).withOverrides(
+            {"fake": fake})
+        instrumented = stats.instrument(mapper)
+        assertIdentical(self, stats.instrument(mapper), instrumented)
+        verifyObject(IMapper, instrumented)
+
+        assertIdentical(self, instrumented.lookup("fake"), fake)
+        assertIdentical(self, instrumented.lookup("sys"), sys)
+        self.assertRaises(ImportError, instrumented.lookup, "os")
+
+        counts = [(description.strip(), layer.lookups, layer.hits,
+                   layer.misses, layer.blocked)
+                  for (description, layer) in stats.layers]
+        self.assertEqual(counts, [
+                ("_StackedMapper", 3, 2, 1, 0),
+                ("DictMapper (1 names)", 3, 1, 2, 0),
+                ("ExclusiveMapper", 2, 1, 1, 1),
+                ("_PEP302Mapper", 1, 1, 0, 0)])
+        self.assertEqual(sorted(stats.names), ["fake", "os", "sys"])
+        self.assertIn("_PEP302Mapper", stats.report())
+
+
+    def test_attribution(self):
+        """
+        Time spent resolving imports is attributed to the module being
+        loaded, when the statistics object is registered as an import hook.
+        """
+        stats = MapperStatistics()
+        addImportHook(stats)
+        self.addCleanup(removeImportHook, stats)
+        mapper = stats.instrument(pep302Mapper)
+        loadNamed("exocet.test.testpackage.foo", mapper)
+        mapper.lookup("sys")
+        self.assertEqual(
+            sorted(stats.modules["exocet.test.testpackage.foo"]),
+            ["exocet", "exocet.test", "exocet.test.testpackage",
+             "exocet.test.testpackage.util", "warnings"])
+        self.assertIn("sys", stats.modules[None])
+
+
+    def test_attributionResolvingImports(self):
+        """
+        Time spent resolving a module's imports before any of its code runs
+        is attributed to the module too.
+        """
+        stats = MapperStatistics()
+        addImportHook(stats)
+        self.addCleanup(removeImportHook, stats)
+        mapper = stats.instrument(DictMapper({"os": os, "os.path": os.path}))
+        loadNamed("exocet.test._ospathExample", mapper, resolveImports=True)
+        self.assertEqual(stats.modules.keys(),
+                         ["exocet.test._ospathExample"])
+        imports = stats.modules["exocet.test._ospathExample"]
+        self.assertIn("os", imports)
+
+
+
 class MiscTests(TestCase):
     """
     Some other stuff.
     """
 
+    def test_modificationTime(self):
+        """
+        L{modificationTime} gets a file's modification time, or C{None} if it
+        can't be determined, even for FilePath-like objects that report
+        missing members with C{KeyError}.
+        """
+        self.assertEqual(modificationTime(FilePath(__file__)),
+                         os.path.getmtime(__file__))
+        class MissingMember(object):
+            def getModificationTime(self):
+                raise KeyError("missing")
+        assertIdentical(self, modificationTime(MissingMember()), None)
+
+
     def test_proxyModule(self):
         """
         L{proxyModule} creates a module wrapper, passing through all
@@ -190,3 +809,24 @@ class MiscTests(TestCase):
         sysEx = proxyModule(sys, stdout=fakeStdout)
         assertIdentical(self, sysEx.stdin, sys.stdin)
         assertIdentical(self, sysEx.stdout, fakeStdout)
+
+
+    def test_cachedProxyModule(self):
+        """
+        L{cachedProxyModule} creates a module with the original module's
+        attributes and the overridden ones, which only picks up changes to
+        the original module when refreshed.
+        """
+        from exocet.test import _ospathExample as original
+        fakePath = object()
+        ex = cachedProxyModule(original, path=fakePath)
+        assertIdentical(self, ex.os, original.os)
+        assertIdentical(self, ex.path, fakePath)
+        self.assertFalse(hasattr(original, "path"))
+
+        original.newAttribute = 1
+        self.addCleanup(delattr, original, "newAttribute")
+        self.assertFalse(hasattr(ex, "newAttribute"))
+        refreshProxy(ex)
+        self.assertEqual(ex.newAttribute, 1)
+        assertIdentical(self, ex.path, fakePath)
@@ -5,17 +5,21 @@
 Tests for L{modules}, abstract access to imported or importable objects.
 """
 
+import os
 import sys
 import itertools
 import zipfile
+import zipimport
 import compileall
+import threading
+from types import ModuleType
 try:
     import ast
 except ImportError:
     ast = None
 
 # Required for addCleanup and mktemp support, at least.
-from twisted.trial.unittest import TestCase
+from twisted.trial.unittest import SkipTest, TestCase
 
 # XXX This suggests that twisted.python.reflect should be the next (or previous)
 # thing to release independently.  We could get it from filepath here, but we
@@ -27,6 +31,7 @@ from exocet._filepath import FilePath
 from exocet.test.test_paths import zipit
 
 import exocet._modules as modules
+from exocet import load, DictMapper
 from exocet._modules import _isPythonIdentifier, _ImportExportFinder
 
 class PySpaceTestCase(TestCase):
@@ -116,6 +121,120 @@ class BasicTests(PySpaceTestCase):
         self.assertEquals(walked[0].isLoaded(), False)
 
 
+    def test_danglingPackageInit(self):
+        """
+        A dangling symlink named like a package's C{__init__} module doesn't
+        make its directory a package.
+        """
+        if not hasattr(os, "symlink"):
+            raise SkipTest("Platform does not support symlinks")
+        entry = FilePath(self.mktemp())
+        package = entry.child("dangling")
+        package.makedirs()
+        os.symlink(entry.child("nowhere").path,
+                   package.child("__init__.py").path)
+        entry.child("module.py").setContent("")
+        self.assertEqual(
+            [m.name for m in modules.PythonPath([entry.path]).iterModules()],
+            ["module"])
+
+
+    def test_moduleIndex(self):
+        """
+        Modules found by searching the path are remembered, until a directory
+        which was searched changes.
+        """
+        first = FilePath(self.mktemp())
+        first.makedirs()
+        second = FilePath(self.mktemp())
+        second.child("pkg").makedirs()
+        second.child("pkg").child("__init__.py").setContent("")
+        second.child("pkg").child("sub.py").setContent("")
+        path = modules.PythonPath(sysPath=[first.path, second.path],
+                                  moduleDict={}, importerCache={},
+                                  sysPathHooks={})
+        self.assertEqual(path["pkg.sub"].filePath,
+                         second.child("pkg").child("sub.py"))
+
+        def noIteration():
+            self.fail("The index wasn't used.")
+        path.iterModules = noIteration
+        self.assertEqual(path["pkg.sub"].filePath,
+                         second.child("pkg").child("sub.py"))
+        self.assertTrue(path["pkg"].isPackage())
+        del path.iterModules
+
+        # Shadow the package with a module earlier on the path.
+        first.child("pkg.py").setContent("")
+        os.utime(first.path, (0, 0))
+        self.assertEqual(path["pkg"].filePath, first.child("pkg.py"))
+        self.assertRaises(KeyError, path.__getitem__, "pkg.sub")
+
+
+    def test_moduleIndexNewPackage(self):
+        """
+        A module remembered in the index is forgotten when a directory of
+        the same name earlier on the path becomes a package.
+        """
+        first = FilePath(self.mktemp())
+        first.child("pkg").makedirs()
+        second = FilePath(self.mktemp())
+        second.child("pkg").makedirs()
+        second.child("pkg").child("__init__.py").setContent("")
+        os.utime(first.path, (1000, 1000))
+        path = modules.PythonPath(sysPath=[first.path, second.path],
+                                  moduleDict={}, importerCache={},
+                                  sysPathHooks={})
+        self.assertEqual(path["pkg"].filePath,
+                         second.child("pkg").child("__init__.py"))
+
+        # Only first/pkg changes, not first.
+        first.child("pkg").child("__init__.py").setContent("")
+        os.utime(first.child("pkg").path, (0, 0))
+        os.utime(first.path, (1000, 1000))
+        self.assertEqual(path["pkg"].filePath,
+                         first.child("pkg").child("__init__.py"))
+
+
+    def test_analysisCache(self):
+        """
+        The static analysis of a module is shared by every L{PythonModule}
+        for it, and kept in the analysis cache directory if there is one,
+        until the module's source changes.
+        """
+        self.patch(modules, "_analysisCache", {})
+        self.patch(modules, "analysisCacheDirectory", None)
+        parsed = []
+        parse = modules.ast.parse
+        self.patch(modules.ast, "parse",
+                   lambda source: parsed.append(source) or parse(source))
+        cacheDirectory = FilePath(self.mktemp())
+        modules.setAnalysisCacheDirectory(cacheDirectory.path)
+        entry = FilePath(self.mktemp())
+        entry.makedirs()
+        source = entry.child("analyzed.py")
+        source.setContent("import os\nx = 1\n")
+        path = modules.PythonPath(sysPath=[entry.path], moduleDict={},
+                                  importerCache={}, sysPathHooks={})
+
+        self.assertEqual(list(path["analyzed"].iterImportNames()), ["os"])
+        self.assertEqual(set(path["analyzed"].iterExportNames()), set(["x"]))
+        self.assertEqual(len(parsed), 1)
+        self.assertEqual(len(cacheDirectory.children()), 1)
+
+        # Another process would only have the cache directory.
+        modules._analysisCache.clear()
+        self.assertEqual(list(path["analyzed"].iterRequiredImports()),
+                         [(None, "os")])
+        self.assertEqual(len(parsed), 1)
+
+        source.setContent("import sys\n")
+        os.utime(source.path, (0, 0))
+        self.assertEqual(list(path["analyzed"].iterImportNames()), ["sys"])
+        self.assertEqual(len(parsed), 2)
+        self.assertEqual(len(cacheDirectory.children()), 2)
+
+
     def test_nonexistentPaths(self):
         """
         Verify that L{modules.walkModules} ignores entries in sys.path which
@@ -190,6 +309,108 @@ class BasicTests(PySpaceTestCase):
                                  where=modules.getModule('exocet')))
 
 
+    def test_parallelWalk(self):
+        """
+        Walking modules with threads yields the same modules as walking them
+        one at a time, in the same order unless told otherwise.
+        """
+        entry = FilePath(self.mktemp())
+        for pkg in ["a", "a/b", "a/b/c", "a/d", "e"]:
+            pkgPath = entry.preauthChild(pkg)
+            pkgPath.makedirs()
+            pkgPath.child("__init__.py").setContent("")
+            pkgPath.child("mod.py").setContent("")
+        entry.child("top.py").setContent("")
+        path = modules.PythonPath(sysPath=[entry.path], moduleDict={},
+                                  importerCache={}, sysPathHooks={})
+        walked = [m.name for m in path.walkModules()]
+        self.assertEqual(len(walked), 11)
+        self.assertEqual([m.name for m in path.walkModules(threads=3)],
+                         walked)
+        self.assertEqual(
+            sorted(m.name for m in path.walkModules(threads=3, ordered=False)),
+            sorted(walked))
+        a = path["a"]
+        self.assertEqual([m.name for m in a.walkModules(threads=2)],
+                         [m.name for m in a.walkModules()])
+
+
+    def test_parallelWalkErrors(self):
+        """
+        Errors listing packages in threads are raised by the walk.
+        """
+        path = modules.PythonPath(
+            sysPath=[self.pathEntryWithOnePackage().path], moduleDict={},
+            importerCache={}, sysPathHooks={})
+        pkg = path["test_package"]
+        def broken(placesToLook):
+            raise IOError("unlistable")
+        pkg._iterModulesIn = broken
+        for ordered in [True, False]:
+            walk = pkg.walkModules(threads=2, ordered=ordered)
+            self.assertIdentical(walk.next(), pkg)
+            self.assertRaises(IOError, walk.next)
+
+
+    def test_parallelWalkWhileLoading(self):
+        """
+        Packages are found through the C{__path__} of loaded packages even
+        while a module found by the walk is being loaded, and C{sys.modules}
+        is swapped out.
+        """
+        first = FilePath(self.mktemp())
+        second = FilePath(self.mktemp())
+        nsp = first.child("nsp")
+        nsp.child("sub").makedirs()
+        nsp.child("__init__.py").setContent("")
+        nsp.child("sub").child("__init__.py").setContent("")
+        nsp.child("zplugin.py").setContent("import sync\nsync.inLoad()\n")
+        second.child("nsp").child("sub").makedirs()
+        second.child("nsp").child("sub").child("extra.py").setContent("")
+
+        for name, filePath in [("nsp", nsp), ("nsp.sub", nsp.child("sub"))]:
+            m = ModuleType(name)
+            m.__file__ = filePath.child("__init__.py").path
+            m.__path__ = [filePath.path]
+            sys.modules[name] = m
+            self.addCleanup(sys.modules.pop, name, None)
+        sys.modules["nsp"].sub = sys.modules["nsp.sub"]
+        sys.modules["nsp.sub"].__path__.append(
+            second.child("nsp").child("sub").path)
+
+        # Hold up listing packages in other threads until a module is being
+        # loaded, and that module until they've looked at what's loaded.
+        loading = threading.Event()
+        checked = threading.Event()
+        isLoaded = modules.PythonModule.isLoaded
+        def slowIsLoaded(pm):
+            if pm.name != "nsp.sub":
+                return isLoaded(pm)
+            if threading.current_thread() is not mainThread:
+                loading.wait(5)
+            try:
+                return isLoaded(pm)
+            finally:
+                checked.set()
+        mainThread = threading.current_thread()
+        self.patch(modules.PythonModule, "isLoaded", slowIsLoaded)
+        sync = ModuleType("sync")
+        def inLoad():
+            loading.set()
+            checked.wait(5)
+        sync.inLoad = inLoad
+
+        path = modules.PythonPath(sysPath=[first.path],
+                                  importerCache={first.path: None})
+        walked = []
+        for pm in path["nsp"].walkModules(threads=2, ordered=False):
+            walked.append(pm.name)
+            if pm.name == "nsp.zplugin":
+                load(pm, DictMapper({"sync": sync}))
+        self.assertEqual(sorted(walked), ["nsp", "nsp.sub", "nsp.sub.extra",
+                                          "nsp.zplugin"])
+
+
     def test_onlyTopModules(self):
         """
         Verify that the iterModules API will only return top-level modules and
@@ -407,6 +628,24 @@ class PathModificationTest(PySpaceTestCase):
         self._listModules()
 
 
+    def test_listingModulesOrder(self):
+        """
+        iterModules yields modules and packages in file name order, skipping
+        directories which aren't packages and files which can't be modules.
+        """
+        self.packagePath.child("e").createDirectory()
+        self.packagePath.child("e").child("e.py").setContent("")
+        self.packagePath.child("f").createDirectory()
+        self.packagePath.child("f").child("__init__.pyc").setContent("")
+        self.packagePath.child("g-h.py").setContent("")
+        self._setupSysPath()
+        pkginfo = modules.getModule(self.packageName)
+        self.assertEqual([(modinfo.name.split(".")[-1], modinfo.isPackage())
+                          for modinfo in pkginfo.iterModules()],
+                         [('a', False), ('b', False), ('c__init__', False),
+                          ('d', False), ('f', True)])
+
+
     def test_listingModulesAlreadyImported(self):
         """
         Make sure the module list comes back as we expect from iterModules on a
@@ -484,6 +723,20 @@ class PathModificationTest(PySpaceTestCase):
                                  "twisted.python.components.registerAdapter"]))
 
 
+    def test_moduleRequiredImports(self):
+        """
+        The imports a module performs unconditionally at its top level can be
+        inspected, in order.
+        """
+        self._setupSysPath()
+        modinfo = modules.getModule(self.packageName + ".a")
+        self.assertEqual(list(modinfo.iterRequiredImports()),
+                         [(None, "sys"), (None, "os"),
+                          ("twisted.python", "reflect"),
+                          (None, "twisted.python.filepath"),
+                          ("twisted.python.components", "registerAdapter")])
+
+
     def test_moduleExportDefinedNames(self):
         """
         The exports of a module with no __all__ are all its defined
@@ -631,6 +884,34 @@ class PythonPathTestCase(TestCase):
 
 
 
+class ZipMapperTests(TestCase):
+    """
+    Tests for mapping zipimport path entries to L{ZipPath}s.
+    """
+
+    def test_archiveReused(self):
+        """
+        The same L{ZipArchive} is used for all paths in an archive until the
+        archive is modified.
+        """
+        directory = FilePath(self.mktemp())
+        directory.child("pkg").makedirs()
+        directory.child("pkg").child("__init__.py").setContent("")
+        archive = directory.path + ".zip"
+        zipit(directory.path, archive)
+        mapper = modules.IPathImportMapper(zipimport.zipimporter(archive))
+
+        za = mapper.mapPath(archive)
+        pkg = mapper.mapPath(os.path.join(archive, "pkg"))
+        self.assertIdentical(pkg.archive, za)
+        self.assertIdentical(modules.IPathImportMapper(
+                zipimport.zipimporter(archive)).mapPath(archive), za)
+
+        os.utime(archive, (0, 0))
+        self.assertNotIdentical(mapper.mapPath(archive), za)
+
+
+
 class ASTVisitorTests(TestCase):
     """
     Tests for L{ast.NodeVisitor} subclasses used to extract
@@ -5,7 +5,7 @@
 Test cases covering L{filepath.FilePath} and L{filepath.ZipPath}.
 """
 
-import os, time, pickle, errno, zipfile, stat
+import os, time, pickle, errno, zipfile, stat, threading
 
 from twisted.trial import unittest
 
@@ -327,6 +327,77 @@ class ZipFilePathTestCase(AbstractFilePathTestCase):
 
 
 
+    def test_contentCache(self):
+        """
+        With a content cache, members' contents are only decompressed again
+        once they've been evicted in favour of more recently read ones.
+        """
+        cache = self.path.cacheContents(maxSize=len(self.f1content))
+        one = self.path.child("file1")
+        two = self.path.child("sub1").child("file2")
+        self.assertEqual(one.getContent(), self.f1content)
+        self.assertEqual(one.getContent(), self.f1content)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(two.getContent(), self.f2content)
+        self.assertEqual(one.getContent(), self.f1content)
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+        self.assertEqual(cache.size, len(self.f1content))
+
+
+    def test_concurrentReads(self):
+        """
+        Members can be read from several threads at once, through the
+        archive's one C{ZipFile}, without reading its central directory again.
+        """
+        members = [(self.path.child("file1"), self.f1content),
+                   (self.path.child("sub1").child("file2"), self.f2content)]
+        opened = []
+        class CountingZipFile(zipfile.ZipFile):
+            def __init__(self, *args, **kwargs):
+                opened.append(args)
+                zipfile.ZipFile.__init__(self, *args, **kwargs)
+        self.patch(zipfile, "ZipFile", CountingZipFile)
+        errors = []
+        def read():
+            try:
+                for i in range(50):
+                    for member, content in members:
+                        self.assertEqual(member.getContent(), content)
+            except Exception, e:
+                errors.append(e)
+        threads = [threading.Thread(target=read) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(opened, [])
+
+
+    def test_directoryIndex(self):
+        """
+        L{ZipPath.isdir} and L{ZipPath.listdir} agree with the archive's
+        C{childmap}, including for explicit directory members and members with
+        absolute names.
+        """
+        archive = self.mktemp()
+        zf = zipfile.ZipFile(archive, "w")
+        for name in ["a/", "a/b/c.py", "a/b.py", "a.txt", "/abs/d.py"]:
+            zf.writestr(name, "")
+        zf.close()
+        za = _zippath.ZipArchive(archive)
+        childmap = za.childmap
+        for path in ["", "a", "a/b", "a/b/c.py", "a.txt", "abs", "/abs",
+                     "missing"]:
+            zp = _zippath.ZipPath(za, path)
+            self.assertEqual(zp.isdir(), path in childmap)
+            if path in childmap:
+                self.assertEqual(sorted(zp.listdir()),
+                                 sorted(childmap[path]))
+        self.assertEqual(sorted(za.listdir()), ["", "a", "a.txt", "abs"])
+
+
+
 class ExplodingFile:
     """
     A C{file}-alike which raises exceptions from its I/O methods and keeps track
@@ -1,8 +1,16 @@
+import __builtin__
+import os
+import sys
+import threading
+import time
+
 from twisted.trial import unittest
 
 import zope.interface
 
 import bravo_plugin
+import exocet
+from exocet._modules import PythonPath
 
 class EdgeHolder(object):
 
@@ -126,6 +134,370 @@ class TestOptions(unittest.TestCase):
         d = {"first": None, "second": None}
         self.assertEqual(["second"], bravo_plugin.expand_names(d, names))
 
+class TestMapper(unittest.TestCase):
+
+    def test_blacklisted_submodule(self):
+        """
+        Submodules of blacklisted packages are blacklisted too.
+        """
+
+        self.assertFalse(bravo_plugin.bravoMapper.contains("ctypes"))
+        self.assertFalse(bravo_plugin.bravoMapper.contains("ctypes.util"))
+
+    def test_enable_statistics(self):
+        """
+        Enabling statistics instruments the plugin mapper.
+        """
+
+        self.patch(bravo_plugin, "statistics", None)
+        stats = bravo_plugin.enable_statistics()
+        self.addCleanup(exocet.removeImportHook, stats)
+        self.assertIdentical(bravo_plugin.enable_statistics(), stats)
+        list(bravo_plugin.get_plugins(ITestInterface,
+                                     "exocet.test.testpackage"))
+        self.assertNotEqual(stats.layers, [])
+        self.assertNotEqual(stats.modules, {})
+
+    def test_rebuild_mapper(self):
+        """
+        The blacklist can't be changed in place, only replaced, and the
+        mapper rebuilt with it.
+        """
+
+        self.assertIsInstance(bravo_plugin.blacklisted, frozenset)
+        self.patch(bravo_plugin, "blacklisted", bravo_plugin.blacklisted)
+        self.patch(bravo_plugin, "bravoMapper", bravo_plugin.bravoMapper)
+        self.patch(bravo_plugin, "module_cache", bravo_plugin.module_cache)
+        self.patch(bravo_plugin, "__cache", {"cached": "plugins"})
+        bravo_plugin.blacklisted |= frozenset(["pickle"])
+        bravo_plugin.rebuild_mapper()
+        self.assertFalse(bravo_plugin.bravoMapper.contains("pickle"))
+        self.assertFalse(bravo_plugin.bravoMapper.contains("ctypes"))
+        self.assertTrue(bravo_plugin.bravoMapper.contains("os"))
+        self.assertEqual(getattr(bravo_plugin, "__cache"), {})
+
+    def test_use_spec_loader(self):
+        """
+        Plugin modules can be loaded with ``exocet.specLoad``.
+        """
+
+        self.patch(bravo_plugin, "loader", bravo_plugin.loader)
+        self.patch(bravo_plugin, "module_cache", bravo_plugin.module_cache)
+        bravo_plugin.use_spec_loader()
+        self.assertIdentical(bravo_plugin.loader, exocet.specLoad)
+        list(bravo_plugin.get_plugins(ITestInterface,
+                                     "exocet.test.testpackage"))
+        self.assertTrue(bravo_plugin.module_cache.getNamed(
+            "exocet.test.testpackage.util", bravo_plugin.bravoMapper))
+
+    def test_use_plugin_bundle(self):
+        """
+        Plugins can be discovered in a bundle.
+        """
+
+        self.patch(bravo_plugin, "plugin_path", None)
+        self.patch(bravo_plugin, "plugin_mapper", None)
+        self.patch(bravo_plugin, "module_cache", bravo_plugin.module_cache)
+        bundle = self.mktemp()
+        exocet.writeBundle("exocet.test.testpackage", bundle)
+        bravo_plugin.use_plugin_bundle(bundle)
+        list(bravo_plugin.get_plugins(ITestInterface,
+                                     "exocet.test.testpackage"))
+        m = bravo_plugin.module_cache.getNamed("exocet.test.testpackage.foo",
+                                               bravo_plugin.plugin_mapper)
+        self.assertTrue(m.__file__.startswith(bundle))
+        # Its import of a sibling module came from the bundle too.
+        self.assertTrue(m.util.__file__.startswith(bundle))
+        self.assertEqual(m.fooName, "hooray")
+        # And it was only loaded once, for both discovery and its siblings.
+        self.assertIdentical(bravo_plugin.module_cache.getNamed(
+            "exocet.test.testpackage.util", bravo_plugin.plugin_mapper),
+            m.util)
+
+    def test_discovery_threads(self):
+        """
+        Plugin packages can be listed in threads during discovery.
+        """
+
+        self.patch(bravo_plugin, "discovery_threads", 2)
+        self.patch(bravo_plugin, "module_cache", exocet.ModuleCache())
+        list(bravo_plugin.get_plugins(ITestInterface,
+                                     "exocet.test.testpackage"))
+        self.assertTrue(bravo_plugin.module_cache.getNamed(
+            "exocet.test.testpackage.util", bravo_plugin.bravoMapper))
+
+def spin(*args, **kwargs):
+    while True:
+        pass
+
+class TestLoadBudget(unittest.TestCase):
+
+    def test_wall_budget(self):
+        e = self.assertRaises(bravo_plugin.LoadBudgetExceeded,
+                              bravo_plugin._call_with_budget,
+                              "slow", 0.05, None, spin)
+        self.assertEqual(e.module, "slow")
+        self.assertEqual(e.resource, "wall")
+        self.assertTrue(e.used >= 0.05)
+
+    def test_cpu_budget(self):
+        e = self.assertRaises(bravo_plugin.LoadBudgetExceeded,
+                              bravo_plugin._call_with_budget,
+                              "slow", None, 0.05, spin)
+        self.assertEqual(e.resource, "cpu")
+
+    def test_budget_in_thread(self):
+        """
+        Budgets are enforced outside of the main thread too.
+        """
+
+        errors = []
+        def run():
+            try:
+                bravo_plugin._call_with_budget("slow", 0.05, None, spin)
+            except bravo_plugin.LoadBudgetExceeded, e:
+                errors.append(e)
+        t = threading.Thread(target=run)
+        t.start()
+        t.join(5)
+        self.assertEqual([e.resource for e in errors], ["wall"])
+
+    def test_within_budget(self):
+        self.assertEqual(bravo_plugin._call_with_budget("quick", 5, 5, len,
+                                                        "abc"), 3)
+
+    def test_untraced_within_budget(self):
+        """
+        Code isn't traced line by line until it's over budget.
+        """
+
+        def traced():
+            return sys._getframe().f_trace
+        self.assertIdentical(bravo_plugin._call_with_budget("quick", 5, 5,
+            traced), None)
+
+    def test_calls_after_expiry(self):
+        """
+        Functions called once the budget has run out are interrupted too.
+        """
+
+        # Like Exocet running a module, this isn't interrupted itself.
+        namespace = {"time": time}
+        exec compile("def call_later(f):\n"
+                     "    time.sleep(0.1)\n"
+                     "    f()\n", bravo_plugin.__file__, "exec") in namespace
+        e = self.assertRaises(bravo_plugin.LoadBudgetExceeded,
+                              bravo_plugin._call_with_budget,
+                              "slow", 0.05, None, namespace["call_later"],
+                              spin)
+        self.assertEqual(e.resource, "wall")
+
+    def test_finalizers_not_interrupted(self):
+        """
+        Running out of time in a finalizer doesn't lose the budget.
+        """
+
+        class Finalized(object):
+            def __del__(self):
+                x = 0
+                x += 1
+                x += 1
+                x += 1
+        def churn():
+            start = time.time()
+            while time.time() - start < 2:
+                Finalized()
+        e = self.assertRaises(bravo_plugin.LoadBudgetExceeded,
+                              bravo_plugin._call_with_budget,
+                              "churn", 0.05, None, churn)
+        self.assertTrue(e.used < 1)
+
+    def test_import_state_restored(self):
+        """
+        Exocet's isolation of a module is always undone, however late it runs
+        out of time, and the module can't swallow the error.
+        """
+
+        entry = self.mktemp()
+        os.makedirs(entry)
+        with open(os.path.join(entry, "slowplugin.py"), "w") as f:
+            f.write("import os\n"
+                    "while True:\n"
+                    "    try:\n"
+                    "        import xml.dom.minidom\n"
+                    "    except Exception:\n"
+                    "        pass\n")
+        pm = PythonPath(sysPath=[entry], moduleDict={})["slowplugin"]
+        original_import = __builtin__.__import__
+        meta_path = list(sys.meta_path)
+        modules = sys.modules
+        module_names = set(sys.modules)
+        for i in range(30):
+            self.assertRaises(bravo_plugin.LoadBudgetExceeded,
+                              bravo_plugin._call_with_budget, "slowplugin",
+                              0.001 * (i % 5), None, exocet.load, pm,
+                              exocet.pep302Mapper)
+            self.assertIdentical(__builtin__.__import__, original_import)
+            self.assertEqual(sys.meta_path, meta_path)
+            self.assertIdentical(sys.modules, modules)
+            self.assertTrue(module_names <= set(sys.modules))
+            self.assertNotIn("slowplugin", sys.modules)
+
+    def test_get_plugins_skips_slow_modules(self):
+        self.patch(bravo_plugin, "loader", spin)
+        self.patch(bravo_plugin, "budget_reports", [])
+        self.patch(bravo_plugin, "load_budget", None)
+        bravo_plugin.set_load_budget(wall=0.01)
+        self.assertEqual(list(bravo_plugin.get_plugins(ITestInterface,
+            "exocet.test.testpackage")), [])
+        self.assertEqual(
+            sorted(e.module for e in bravo_plugin.budget_reports),
+            ["exocet.test.testpackage.baz", "exocet.test.testpackage.foo",
+             "exocet.test.testpackage.topmodule",
+             "exocet.test.testpackage.util"])
+
+class TestBrokenModules(unittest.TestCase):
+
+    def setUp(self):
+        self.loaded = []
+        self.mtime = 1
+        self.patch(bravo_plugin, "loader", self.broken_loader)
+        self.patch(bravo_plugin, "broken_modules", {})
+        self.patch(bravo_plugin, "modificationTime", lambda fp: self.mtime)
+
+    def broken_loader(self, pm, mapper, **kwargs):
+        self.loaded.append(pm.name)
+        raise ImportError("%s is broken" % pm.name)
+
+    def discover(self, parameters=None):
+        return list(bravo_plugin.get_plugins(ITestInterface,
+            "exocet.test.testpackage", parameters))
+
+    def test_broken_modules_skipped(self):
+        self.discover()
+        self.assertEqual(len(self.loaded), 4)
+        del self.loaded[:]
+        self.discover()
+        self.assertEqual(self.loaded, [])
+
+    def test_broken_modules_retried_when_changed(self):
+        self.discover()
+        del self.loaded[:]
+        self.mtime = 2
+        self.discover()
+        self.assertEqual(len(self.loaded), 4)
+
+    def test_broken_modules_per_parameters(self):
+        self.discover()
+        del self.loaded[:]
+        self.discover({"foo": 1})
+        self.assertEqual(len(self.loaded), 4)
+
+    def test_list_broken_plugins(self):
+        self.discover()
+        self.discover({"foo": 1})
+        broken = bravo_plugin.list_broken_plugins()
+        self.assertEqual([name for name, path, error in broken],
+            ["exocet.test.testpackage.baz", "exocet.test.testpackage.foo",
+             "exocet.test.testpackage.topmodule",
+             "exocet.test.testpackage.util"])
+        name, path, error = broken[0]
+        self.assertTrue(path.endswith("baz.py"))
+        self.assertEqual(str(error), "exocet.test.testpackage.baz is broken")
+
+    def test_list_broken_plugins_changed(self):
+        self.discover()
+        self.mtime = 2
+        self.assertEqual(bravo_plugin.list_broken_plugins(), [])
+
+class TestPluginCache(unittest.TestCase):
+
+    def setUp(self):
+        self.discoveries = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.patch(bravo_plugin, "__cache", {})
+        self.patch(bravo_plugin, "_discover_plugins", self.discover)
+
+    def discover(self, interface, parameters):
+        self.discoveries.append(interface)
+        self.started.set()
+        self.release.wait(5)
+        if len(self.discoveries) == 1 and getattr(self, "fail_first", False):
+            raise RuntimeError("discovery failed")
+        return {"discovery": len(self.discoveries)}
+
+    def retrieve_in_threads(self, count):
+        results = []
+        def run():
+            try:
+                results.append(bravo_plugin.retrieve_plugins(ITestInterface))
+            except RuntimeError, e:
+                results.append(e)
+        threads = [threading.Thread(target=run) for i in range(count)]
+        threads[0].start()
+        self.started.wait(5)
+        for t in threads[1:]:
+            t.start()
+        self.release.set()
+        for t in threads:
+            t.join(5)
+        return results
+
+    def test_single_flight(self):
+        results = self.retrieve_in_threads(3)
+        self.assertEqual(self.discoveries, [ITestInterface])
+        self.assertEqual(results, [{"discovery": 1}] * 3)
+        self.assertIdentical(bravo_plugin.retrieve_plugins(ITestInterface),
+                             results[0])
+
+    def test_failed_discovery_retried(self):
+        self.fail_first = True
+        results = self.retrieve_in_threads(2)
+        self.assertEqual(len(self.discoveries), 2)
+        self.assertEqual(len(results), 2)
+        self.assertIn({"discovery": 2}, results)
+        self.assertTrue([r for r in results if isinstance(r, RuntimeError)])
+
+    def test_parameters_not_cached(self):
+        self.release.set()
+        bravo_plugin.retrieve_plugins(ITestInterface, {"foo": 1})
+        bravo_plugin.retrieve_plugins(ITestInterface, {"foo": 1})
+        self.assertEqual(len(self.discoveries), 2)
+
+class TestDiscoveryLock(unittest.TestCase):
+
+    def setUp(self):
+        self.active = []
+        self.overlapped = False
+        self.patch(bravo_plugin, "__cache", {})
+        self.patch(bravo_plugin, "get_plugins", self.get_plugins)
+
+    def get_plugins(self, interface, package, parameters=None):
+        thread = threading.current_thread()
+        if [t for t in self.active if t is not thread]:
+            self.overlapped = True
+        self.active.append(thread)
+        try:
+            threading.Event().wait(0.2)
+            if interface is ITestInterface:
+                # A plugin asking for other plugins while it's loaded.
+                bravo_plugin.retrieve_plugins(IOtherInterface)
+        finally:
+            self.active.remove(thread)
+        return []
+
+    def test_interfaces_take_turns(self):
+        threads = [threading.Thread(target=bravo_plugin.retrieve_plugins,
+                                    args=(i,))
+                   for i in (ITestInterface, IOtherInterface)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(5)
+        self.assertFalse([t for t in threads if t.isAlive()])
+        self.assertFalse(self.overlapped)
+
 class ITestInterface(zope.interface.Interface):
 
     name = zope.interface.Attribute("")
@@ -133,6 +505,9 @@ class ITestInterface(zope.interface.Interface):
     def meth(arg):
         pass
 
+class IOtherInterface(zope.interface.Interface):
+    pass
+
 class TestVerifyPlugin(unittest.TestCase):
 
     def test_no_name(self):